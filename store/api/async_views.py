@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.generics import get_object_or_404
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .authentication import aauthenticate
+from .cache import aget_catalog_version, aget_stock_version
+from .exceptions import api_exception_handler
+from .serializers import (ProductGroupReadSerializer, ProductReadSerializer,
+                          TypeSerializer)
+from .views import (CatalogPaginationMixin, add_conditional_headers,
+                    get_catalog_validators)
+from products.models import CartProduct, Product, ProductGroup, Type
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return JsonResponse(data, status=status, safe=False, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+class AsyncCatalogView(CatalogPaginationMixin, View):
+    '''
+    Асинхронное чтение каталога для запуска под ASGI.
+    Пока ответ ждет базу данных, процесс обслуживает другие запросы.
+    Ответы совпадают с ответами синхронных представлений: та же
+    пагинация, ETag и представления из кэша каталога. Пагинация
+    и сериализация обращаются к кэшу синхронно и выполняются
+    в потоке через sync_to_async.
+    '''
+    http_method_names = ['get', 'head']
+    queryset = None
+    serializer_class = None
+    depends_on_stock = False
+
+    async def get(self, request, pk=None):
+        self.request = request = Request(request)
+        try:
+            request.user = await aauthenticate(request)
+            context = await self.get_serializer_context(request)
+
+            versions = [await aget_catalog_version()]
+            if self.depends_on_stock:
+                versions.append(await aget_stock_version())
+            etag, last_modified = get_catalog_validators(
+                request.build_absolute_uri(), 'application/json', versions,
+                self.get_user_etag_parts(context))
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                if pk is None:
+                    response = await self.list(request, context)
+                else:
+                    response = await self.retrieve(request, pk, context)
+        except (exceptions.APIException, Http404) as error:
+            response = api_exception_handler(
+                error, {'view': self, 'request': request})
+            return json_response(response.data, status=response.status_code)
+        return add_conditional_headers(response, etag, last_modified)
+
+    async def get_serializer_context(self, request):
+        return {'request': request}
+
+    def get_user_etag_parts(self, context):
+        return ()
+
+    async def list(self, request, context):
+        return json_response(await sync_to_async(self.paginate)(
+            request, context))
+
+    def paginate(self, request, context):
+        page = self.paginator.paginate_queryset(self.queryset, request,
+                                                view=self)
+        data = self.serializer_class(page, many=True, context=context).data
+        return self.paginator.get_paginated_response(data).data
+
+    async def retrieve(self, request, pk, context):
+        return json_response(await sync_to_async(self.serialize)(
+            pk, context))
+
+    def serialize(self, pk, context):
+        instance = get_object_or_404(self.queryset, pk=pk)
+        return self.serializer_class(instance, context=context).data
+
+
+class AsyncProductGroupView(AsyncCatalogView):
+    '''Асинхронное чтение продуктовых категорий.'''
+    queryset = ProductGroup.objects.prefetch_related('type_set')
+    serializer_class = ProductGroupReadSerializer
+
+
+class AsyncTypeView(AsyncCatalogView):
+    '''Асинхронное чтение подкатегорий.'''
+    queryset = Type.objects.select_related('product_group')
+    serializer_class = TypeSerializer
+
+
+class AsyncProductView(AsyncCatalogView):
+    '''Асинхронное чтение продуктов.'''
+    queryset = Product.objects.with_stock().select_related(
+        'type__product_group').prefetch_related('images')
+    serializer_class = ProductReadSerializer
+    depends_on_stock = True
+
+    async def get_serializer_context(self, request):
+        context = await super().get_serializer_context(request)
+        if not request.user.is_anonymous:
+            context['cart_product_ids'] = {
+                product_id async for product_id in
+                CartProduct.objects.filter(
+                    cart__user=request.user
+                ).values_list('product_id', flat=True)
+            }
+        return context
+
+    def get_user_etag_parts(self, context):
+        if 'cart_product_ids' not in context:
+            return ()
+        return (sorted(context['cart_product_ids']),)
@@ -0,0 +1,117 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import router
+from django.utils.crypto import salted_hmac
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+# Поля пользователя в кэше. Остальные поля загружаются из базы данных
+# при первом обращении к ним.
+SNAPSHOT_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def get_token_cache_key(key) -> str:
+    '''В ключе кэша хранится хэш токена, а не сам токен.'''
+    return f'auth_token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_user_snapshot(user) -> dict:
+    '''
+    Данные пользователя для кэша. Вместо хэша пароля хранится
+    его отпечаток: по нему видно, что пароль сменился.
+    '''
+    snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+    snapshot['password'] = salted_hmac(
+        'api.authentication.get_user_snapshot', user.password).hexdigest()
+    return snapshot
+
+
+def user_from_snapshot(snapshot):
+    '''Пользователь из снимка без обращения к базе данных.'''
+    # from_db принимает значения в порядке полей модели.
+    fields = [field.attname for field in User._meta.concrete_fields
+              if field.attname in SNAPSHOT_FIELDS]
+    return User.from_db(router.db_for_read(User), fields,
+                        [snapshot[field] for field in fields])
+
+
+def invalidate_token_cache(keys):
+    cache.delete_many([get_token_cache_key(key) for key in keys])
+
+
+def invalidate_changed_users(user, keys):
+    '''Удаляет из кэша токены, снимок пользователя в которых устарел.'''
+    snapshot = get_user_snapshot(user)
+    cached = cache.get_many([get_token_cache_key(key) for key in keys])
+    stale = [cache_key for cache_key, value in cached.items()
+             if value != snapshot]
+    if stale:
+        cache.delete_many(stale)
+
+
+def cache_token(token):
+    if settings.AUTH_TOKEN_CACHE_TIMEOUT > 0:
+        cache.set(get_token_cache_key(token.key),
+                  get_user_snapshot(token.user),
+                  settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+
+async def acache_token(token):
+    if settings.AUTH_TOKEN_CACHE_TIMEOUT > 0:
+        await cache.aset(get_token_cache_key(token.key),
+                         get_user_snapshot(token.user),
+                         settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Аутентификация по токену, которая хранит в кэше снимок
+    пользователя токена без хэша пароля, поэтому повторные запросы
+    не обращаются к базе данных. Запись удаляется при удалении токена
+    и при изменении пользователя (смена пароля, блокировка), а в
+    остальных случаях живет AUTH_TOKEN_CACHE_TIMEOUT секунд.
+    Неверные токены не кэшируются.
+    '''
+
+    def authenticate_credentials(self, key):
+        snapshot = cache.get(get_token_cache_key(key))
+        if snapshot is None or not snapshot['is_active']:
+            user, token = super().authenticate_credentials(key)
+            cache_token(token)
+            return user, token
+        user = user_from_snapshot(snapshot)
+        return user, Token(key=key, user=user)
+
+
+async def aauthenticate(request):
+    '''
+    Асинхронная проверка токена из заголовка Authorization
+    для представлений вне DRF. Без заголовка возвращает анонимного
+    пользователя, при неверном токене - AuthenticationFailed.
+    '''
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != TokenAuthentication.keyword:
+        return AnonymousUser()
+    key = key.strip()
+    if not key or ' ' in key:
+        raise exceptions.AuthenticationFailed(
+            'Недопустимый заголовок токена.')
+    snapshot = await cache.aget(get_token_cache_key(key))
+    if snapshot is not None and snapshot['is_active']:
+        return user_from_snapshot(snapshot)
+    token = await Token.objects.select_related('user').filter(
+        key=key).afirst()
+    if token is None:
+        raise exceptions.AuthenticationFailed('Недопустимый токен.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(
+            'Пользователь неактивен или удален.')
+    await acache_token(token)
+    return token.user
@@ -0,0 +1,141 @@
+import time
+
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+from django.db.models.manager import BaseManager
+from rest_framework import serializers
+
+CATALOG_CACHE = 'catalog'
+CATALOG_VERSION_KEY = 'version'
+STOCK_VERSION_KEY = 'stock_version'
+
+
+def _get_version(key) -> int:
+    '''Версия - время последнего изменения в наносекундах.'''
+    cache = caches[CATALOG_CACHE]
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+async def _aget_version(key) -> int:
+    cache = caches[CATALOG_CACHE]
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def _bump_version(key):
+    caches[CATALOG_CACHE].set(key, time.time_ns(), timeout=None)
+
+
+def get_catalog_version() -> int:
+    '''Возвращает текущую версию каталога.'''
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+async def aget_catalog_version() -> int:
+    return await _aget_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    '''Делает устаревшими все закэшированные представления каталога.'''
+    _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_stock_version() -> int:
+    '''
+    Возвращает версию остатков товаров. Остатки не кэшируются
+    вместе с представлениями и меняются без смены версии каталога.
+    '''
+    return _get_version(STOCK_VERSION_KEY)
+
+
+async def aget_stock_version() -> int:
+    return await _aget_version(STOCK_VERSION_KEY)
+
+
+def bump_stock_version():
+    _bump_version(STOCK_VERSION_KEY)
+
+
+class CachedListSerializer(serializers.ListSerializer):
+    '''
+    Читает представления всех объектов списка одним запросом к кэшу
+    и сериализует только отсутствующие в нем объекты.
+    '''
+
+    def to_representation(self, data):
+        if isinstance(data, BaseManager):
+            data = data.all()
+        items = list(data)
+        child = self.child
+        version = get_catalog_version()
+        keys = [child.get_cache_key(item, version) for item in items]
+
+        cache = caches[CATALOG_CACHE]
+        cached = cache.get_many(keys)
+        missing = [item for item, key in zip(items, keys)
+                   if key not in cached]
+        if missing and child.cache_prefetch_related:
+            prefetch_related_objects(missing,
+                                     *child.cache_prefetch_related)
+
+        new_entries = {}
+        representation = []
+        for item, key in zip(items, keys):
+            if key not in cached:
+                new_entries[key] = child.get_cacheable_representation(item)
+            item_data = dict(cached.get(key) or new_entries[key])
+            representation.append(child.add_uncached_fields(item, item_data))
+        if new_entries:
+            cache.set_many(new_entries)
+        return representation
+
+
+class CachedRepresentationMixin:
+    '''
+    Кэширует представление объекта до следующего изменения каталога.
+    Поля из uncached_fields зависят от запроса и вычисляются каждый раз.
+    Для списков в Meta указывается
+    list_serializer_class = CachedListSerializer.
+    '''
+    uncached_fields = ()
+    cache_prefetch_related = ()
+
+    def get_cache_key(self, instance, version) -> str:
+        '''
+        Ключ зависит от хоста запроса, так как ссылки на изображения
+        в представлении абсолютные.
+        '''
+        request = self.context.get('request')
+        host = request.build_absolute_uri('/') if request else ''
+        return f'{type(self).__name__}:{version}:{instance.pk}:{host}'
+
+    def get_cacheable_representation(self, instance) -> dict:
+        representation = super().to_representation(instance)
+        for field_name in self.uncached_fields:
+            representation.pop(field_name, None)
+        return dict(representation)
+
+    def add_uncached_fields(self, instance, data) -> dict:
+        for field_name in self.uncached_fields:
+            field = self.fields[field_name]
+            data[field_name] = field.to_representation(
+                field.get_attribute(instance))
+        return data
+
+    def to_representation(self, instance):
+        cache = caches[CATALOG_CACHE]
+        key = self.get_cache_key(instance, get_catalog_version())
+        data = cache.get(key)
+        if data is None:
+            data = self.get_cacheable_representation(instance)
+            cache.set(key, data)
+        return self.add_uncached_fields(instance, dict(data))
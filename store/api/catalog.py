@@ -0,0 +1,104 @@
+import threading
+
+from django.core.files.storage import default_storage
+
+from .cache import get_catalog_version
+from products.models import Product, ProductGroup, Type
+
+
+class CatalogSnapshot:
+    '''
+    Дерево каталога, построенное для одной версии каталога.
+    Хранится в памяти процесса и перестраивается только после
+    изменения категорий, подкатегорий или товаров.
+    '''
+
+    def __init__(self, version, groups):
+        self.version = version
+        self.groups = groups
+        self._rendered = {}
+
+    def render(self, request, with_products):
+        '''
+        Возвращает дерево с абсолютными ссылками на изображения.
+        Результат запоминается для каждого хоста.
+        '''
+        key = (request.build_absolute_uri('/'), with_products)
+        if key not in self._rendered:
+            self._rendered[key] = [
+                self._render_group(request, group, with_products)
+                for group in self.groups
+            ]
+        return self._rendered[key]
+
+    @staticmethod
+    def _render_group(request, group, with_products):
+        types = []
+        for type_node in group['types']:
+            type_data = {
+                **type_node,
+                'image': request.build_absolute_uri(type_node['image']),
+                'thumbnail': request.build_absolute_uri(
+                    type_node['thumbnail']),
+            }
+            if not with_products:
+                type_data.pop('products')
+            types.append(type_data)
+        return {
+            **group,
+            'image': request.build_absolute_uri(group['image']),
+            'thumbnail': request.build_absolute_uri(group['thumbnail']),
+            'types': types,
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def build_catalog_snapshot(version):
+    '''Строит дерево каталога тремя запросами к базе данных.'''
+    products_by_type = {}
+    for product in Product.objects.values('type_id', 'name', 'slug',
+                                          'price').order_by('name'):
+        products_by_type.setdefault(product.pop('type_id'), []).append(
+            product)
+
+    types_by_group = {}
+    for type_node in Type.objects.values('id', 'name', 'slug', 'image',
+                                         'thumbnail', 'product_group_id'):
+        type_node['image'] = _image_url(type_node['image'])
+        type_node['thumbnail'] = (_image_url(type_node['thumbnail'])
+                                  or type_node['image'])
+        type_node['products'] = products_by_type.get(type_node['id'], [])
+        types_by_group.setdefault(type_node.pop('product_group_id'),
+                                  []).append(type_node)
+
+    groups = []
+    for group in ProductGroup.objects.values('id', 'name', 'slug', 'image',
+                                             'thumbnail'):
+        group['image'] = _image_url(group['image'])
+        group['thumbnail'] = _image_url(group['thumbnail']) or group['image']
+        group['types'] = types_by_group.get(group['id'], [])
+        groups.append(group)
+    return CatalogSnapshot(version, groups)
+
+
+def get_catalog_snapshot():
+    '''
+    Возвращает снимок каталога текущей версии.
+    Пока версия каталога не меняется, запросов к базе данных нет.
+    '''
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = build_catalog_snapshot(version)
+        return _snapshot
@@ -0,0 +1,20 @@
+from django.core.exceptions import RequestDataTooBig
+from rest_framework import exceptions, status
+from rest_framework.views import exception_handler
+
+
+class RequestTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос.'
+    default_code = 'request_too_large'
+
+
+def api_exception_handler(exc, context):
+    '''
+    Тело запроса больше DATA_UPLOAD_MAX_MEMORY_SIZE Django отклоняет
+    при чтении request.data, в том числе JSON. Вместо страницы
+    с ошибкой 400 API отвечает ошибкой 413.
+    '''
+    if isinstance(exc, RequestDataTooBig):
+        exc = RequestTooLarge()
+    return exception_handler(exc, context)
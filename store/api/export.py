@@ -0,0 +1,70 @@
+import csv
+import json
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import F
+
+from products.models import Product
+
+EXPORT_CHUNK_SIZE = 2000
+# Колонки совпадают с форматом команды import_catalog.
+EXPORT_COLUMNS = ('group', 'group_slug', 'group_image', 'type', 'type_slug',
+                  'type_image', 'name', 'slug', 'price', 'in_stock',
+                  'images')
+IMAGES_SEPARATOR = '|'
+
+
+def iter_catalog_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Перебирает продукты каталога вместе с подкатегорией, категорией
+    и изображениями. Данные читаются одним запросом частями
+    по chunk_size строк, на PostgreSQL - через серверный курсор.
+    '''
+    rows = Product.objects.with_stock().order_by('id', 'images__id').values(
+        'id', 'name', 'slug', 'price', 'total_in_stock',
+        group=F('type__product_group__name'),
+        group_slug=F('type__product_group__slug'),
+        group_image=F('type__product_group__image'),
+        type_name=F('type__name'),
+        type_slug=F('type__slug'),
+        type_image=F('type__image'),
+        image=F('images__image'),
+    ).iterator(chunk_size=chunk_size)
+    for _, product_rows in groupby(rows, key=itemgetter('id')):
+        first = next(product_rows)
+        images = [first['image']] if first['image'] else []
+        images.extend(row['image'] for row in product_rows)
+        yield {
+            'group': first['group'],
+            'group_slug': first['group_slug'],
+            'group_image': first['group_image'],
+            'type': first['type_name'],
+            'type_slug': first['type_slug'],
+            'type_image': first['type_image'],
+            'name': first['name'],
+            'slug': first['slug'],
+            'price': first['price'],
+            'in_stock': first['total_in_stock'],
+            'images': images,
+        }
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    '''Буфер для csv.writer, возвращающий записанную строку.'''
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row['images'] = IMAGES_SEPARATOR.join(row['images'])
+        yield writer.writerow([row[column] for column in EXPORT_COLUMNS])
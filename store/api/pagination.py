@@ -0,0 +1,19 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CatalogPageNumberPagination(PageNumberPagination):
+    '''Постраничная пагинация с выбором размера страницы клиентом.'''
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
+
+
+class CatalogCursorPagination(CursorPagination):
+    '''
+    Пагинация по курсору по уникальному полю name.
+    Не выполняет COUNT(*) и OFFSET, поэтому время ответа
+    не зависит от глубины страницы.
+    '''
+    ordering = ('name', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
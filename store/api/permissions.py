@@ -14,3 +14,10 @@ class IsAdminOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         return (request.method in permissions.SAFE_METHODS
                 or request.user.is_superuser)
+
+
+class IsAdmin(permissions.BasePermission):
+    '''Позволяет доступ только админам.'''
+
+    def has_permission(self, request, view):
+        return request.user.is_superuser
@@ -1,13 +1,23 @@
-import base64
-
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+import binascii
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
 from djoser.serializers import UserCreateSerializer
+from PIL import Image
 from rest_framework import exceptions, serializers
 from rest_framework.relations import SlugRelatedField
 
+from .cache import CachedListSerializer, CachedRepresentationMixin
 from products.models import (Cart, CartProduct, Product, ProductGroup,
                              ProductImage, Type, User)
+from products.services import (ADD, CART_OPERATIONS, REMOVE, add_to_cart,
+                               save_cart_product, set_stock_shards)
+from store.constans import (CART_BATCH_MAX_OPERATIONS, MAX_CART_AMOUNT,
+                            MAX_LENGTH, MIN_NUM)
 
 
 class UserCreationSerializer(UserCreateSerializer):
@@ -23,52 +33,135 @@ class UserCreationSerializer(UserCreateSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
-    '''Кодировка изображения.'''
+    '''
+    Кодировка изображения.
+    Строка base64 декодируется частями во временный файл: небольшие
+    изображения остаются в памяти, крупные записываются на диск.
+    Размер файла проверяется до декодирования, разрешение -
+    по заголовку изображения.
+    '''
+    default_error_messages = {
+        'invalid_base64': 'Некорректная строка base64.',
+        'too_large': 'Размер изображения не должен превышать '
+                     '{max_size} байт.',
+        'too_many_pixels': 'Изображение не должно быть больше '
+                           '{max_pixels} пикселей.',
+    }
+    chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
 
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(imgstr, name='temp.' + ext,
+                               content_type=format[len('data:'):])
+            self.check_pixels(data)
 
         return super().to_internal_value(data)
 
+    def decode(self, imgstr, name, content_type):
+        '''Декодирует строку base64 в загруженный файл.'''
+        if re.search(r'\s', imgstr):
+            imgstr = re.sub(r'\s', '', imgstr)
+        if len(imgstr) % 4:
+            self.fail('invalid_base64')
+        size = len(imgstr) // 4 * 3 - imgstr[-2:].count('=')
+        if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = TemporaryUploadedFile(name, content_type, size, None)
+        else:
+            file = InMemoryUploadedFile(BytesIO(), None, name,
+                                        content_type, size, None)
+        try:
+            for start in range(0, len(imgstr), self.chunk_size):
+                file.write(binascii.a2b_base64(
+                    imgstr[start:start + self.chunk_size]))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_base64')
+        file.seek(0)
+        return file
+
+    def check_pixels(self, file):
+        '''
+        Отклоняет изображения со слишком большим разрешением
+        до того, как Pillow начнет их декодировать.
+        '''
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width, height = max_pixels, 2
+        except Exception:
+            # Некорректное изображение отклонит родительское поле.
+            width = height = 0
+        file.seek(0)
+        if width * height > max_pixels:
+            file.close()
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+
+
+class ThumbnailField(serializers.ImageField):
+    '''
+    Ссылка на миниатюру изображения.
+    Пока миниатюра не создана, возвращается ссылка на оригинал.
+    '''
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return super().to_representation(instance.thumbnail or instance.image)
+
 
-class TypeSerializer(serializers.ModelSerializer):
+class TypeSerializer(CachedRepresentationMixin,
+                     serializers.ModelSerializer):
     '''Serializer для добавления, редактирования, чтения
     и удаления подкатегории продуктов.'''
     image = Base64ImageField()
+    thumbnail = ThumbnailField()
     product_group = SlugRelatedField(slug_field='name',
                                      queryset=ProductGroup.objects.all())
 
     class Meta:
         model = Type
         fields = (
-            'id', 'name', 'slug', 'image', 'product_group'
+            'id', 'name', 'slug', 'image', 'thumbnail', 'product_group'
         )
+        list_serializer_class = CachedListSerializer
 
 
 class TypeSmallSerializer(serializers.ModelSerializer):
     '''Serializer для чтения списка подкатегории продуктов
     в каждой категории.'''
+    thumbnail = ThumbnailField()
 
     class Meta:
         model = Type
         fields = (
-            'id', 'name', 'slug', 'image'
+            'id', 'name', 'slug', 'image', 'thumbnail'
         )
 
 
-class ProductGroupReadSerializer(serializers.ModelSerializer):
+class ProductGroupReadSerializer(CachedRepresentationMixin,
+                                 serializers.ModelSerializer):
     '''Serializer для чтения продуктовой категории.'''
     types = TypeSmallSerializer(many=True, read_only=True,
                                 source='type_set')
+    thumbnail = ThumbnailField()
+    cache_prefetch_related = ('type_set',)
 
     class Meta:
         model = ProductGroup
         fields = (
-            'id', 'name', 'slug', 'image', 'types'
+            'id', 'name', 'slug', 'image', 'thumbnail', 'types'
         )
+        list_serializer_class = CachedListSerializer
 
 
 class ProductGroupSerializer(serializers.ModelSerializer):
@@ -90,10 +183,11 @@ class ProductGroupSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     '''Сериализатор для изображений продукта.'''
+    thumbnail = ThumbnailField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'thumbnail']
 
 
 class ProductImageAddSerializer(serializers.ModelSerializer):
@@ -135,8 +229,16 @@ class ProductAddSerializer(serializers.ModelSerializer):
             ProductImage.objects.create(product=product, **image_data)
         return product
 
+    def update(self, instance, validated_data):
+        '''Новый остаток продукта с частями остатка делится между ними.'''
+        product = super().update(instance, validated_data)
+        if 'in_stock' in validated_data and product.stock_shards > 1:
+            set_stock_shards(product, product.stock_shards, product.in_stock)
+        return product
+
 
-class ProductReadSerializer(serializers.ModelSerializer):
+class ProductReadSerializer(CachedRepresentationMixin,
+                            serializers.ModelSerializer):
     '''Serializer для чтения продуктов.'''
     images = ProductImageSerializer(many=True, read_only=True)
     type = SlugRelatedField(slug_field='name',
@@ -144,7 +246,10 @@ class ProductReadSerializer(serializers.ModelSerializer):
     product_group = serializers.ReadOnlyField(
         source='type.product_group.name'
     )
+    in_stock = serializers.IntegerField(source='get_total_in_stock',
+                                        read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField()
+    uncached_fields = ('in_stock', 'is_in_shopping_cart')
 
     class Meta:
         model = Product
@@ -152,22 +257,25 @@ class ProductReadSerializer(serializers.ModelSerializer):
             'name', 'slug', 'type', 'product_group', 'price',
             'images', 'in_stock', 'is_in_shopping_cart'
         )
+        list_serializer_class = CachedListSerializer
 
     def get_is_in_shopping_cart(self, obj) -> bool:
         '''Находится ли продукт в корзине.'''
         user = self.context.get('request').user
-        if not user.is_anonymous:
-            return CartProduct.objects.filter(cart__user=user,
-                                              product=obj).exists()
-        return False
-
-    def to_representation(self, instance):
-        '''Удаляет поле is_in_shopping_cart для анонимных пользователей.'''
-        representation = super().to_representation(instance)
-        user = self.context.get('request').user
         if user.is_anonymous:
-            representation.pop('is_in_shopping_cart', None)
-        return representation
+            return False
+        cart_product_ids = self.context.get('cart_product_ids')
+        if cart_product_ids is not None:
+            return obj.pk in cart_product_ids
+        return CartProduct.objects.filter(cart__user=user,
+                                          product=obj).exists()
+
+    def add_uncached_fields(self, instance, data):
+        '''Удаляет поле is_in_shopping_cart для анонимных пользователей.'''
+        data = super().add_uncached_fields(instance, data)
+        if self.context.get('request').user.is_anonymous:
+            data.pop('is_in_shopping_cart', None)
+        return data
 
 
 class ProductInCartSerializer(serializers.ModelSerializer):
@@ -178,6 +286,8 @@ class ProductInCartSerializer(serializers.ModelSerializer):
     product = SlugRelatedField(slug_field='name',
                                queryset=Product.objects.all())
     price = serializers.SerializerMethodField()
+    amount = serializers.IntegerField(min_value=MIN_NUM,
+                                      max_value=MAX_CART_AMOUNT)
 
     class Meta:
         model = CartProduct
@@ -188,65 +298,59 @@ class ProductInCartSerializer(serializers.ModelSerializer):
         return obj.amount * obj.product.price
 
     def validate(self, data):
-        product_name = data.get('product', None)
+        product = data.get('product', None)
         amount = data.get('amount', None)
-        if amount and product_name:
-            product = get_object_or_404(Product, name=product_name)
-            if amount > product.in_stock:
+        if amount is not None and product is not None:
+            in_stock = product.get_total_in_stock()
+            if amount > in_stock:
                 raise exceptions.ValidationError(
                     f'Недостаточно товаров на складе. '
-                    f'Количество товаров в наличии: {product.in_stock}.'
-                )
-            if amount < 1:
-                raise exceptions.ValidationError(
-                    'Количество должно быть больше 0.'
+                    f'Количество товаров в наличии: {in_stock}.'
                 )
         return data
 
     def create(self, validated_data):
         '''Добавление товара в корзину с обновлением остатков.'''
-        product = validated_data['product']
-        amount = validated_data['amount']
-        cart = self.context['cart']
-
         try:
-            cart_product = CartProduct.objects.get(cart=cart,
-                                                   product=product)
-            cart_product.amount += amount
-        except CartProduct.DoesNotExist:
-            cart_product = CartProduct.objects.create(
-                cart=cart,
-                product=product,
-                amount=amount
-            )
-
-        cart_product.save()
-
-        product.in_stock -= amount
-        product.save()
-
-        return cart_product
+            return add_to_cart(self.context['cart'],
+                               validated_data['product'],
+                               validated_data['amount'])
+        except DjangoValidationError as error:
+            raise exceptions.ValidationError(error.messages)
 
     def update(self, instance, validated_data):
         '''Обновление количества товара в корзине.'''
         new_amount = validated_data.pop('amount', None)
-        if new_amount:
-            product = instance.product
-            diff = new_amount - instance.amount
+        if new_amount is not None:
+            instance.amount = new_amount
+            try:
+                save_cart_product(instance)
+            except DjangoValidationError as error:
+                raise exceptions.ValidationError(error.messages)
+        return instance
 
-            if diff > 0 and diff > product.in_stock:
-                raise exceptions.ValidationError(
-                    f'Недостаточно товаров на складе.'
-                    f'Остаток: {product.in_stock}.'
-                )
 
-            product.in_stock -= diff
-            product.save()
+class CartOperationSerializer(serializers.Serializer):
+    '''Serializer одной операции пакетного изменения корзины.'''
+    op = serializers.ChoiceField(choices=CART_OPERATIONS, default=ADD)
+    product = serializers.CharField(max_length=MAX_LENGTH)
+    amount = serializers.IntegerField(min_value=MIN_NUM,
+                                      max_value=MAX_CART_AMOUNT,
+                                      required=False)
 
-            instance.amount = new_amount
-            instance.save()
+    def validate(self, data):
+        if data['op'] != REMOVE and 'amount' not in data:
+            raise exceptions.ValidationError(
+                'Необходимо указать количество.'
+            )
+        return data
 
-        return instance
+
+class CartBatchSerializer(serializers.Serializer):
+    '''Serializer для пакетного изменения корзины.'''
+    operations = CartOperationSerializer(
+        many=True, allow_empty=False,
+        max_length=CART_BATCH_MAX_OPERATIONS)
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -270,8 +374,12 @@ class CartSerializer(serializers.ModelSerializer):
 
     def get_total_price(self, instance) -> int:
         '''Вычисление общей стоимости товаров в корзине.'''
+        if hasattr(instance, 'total_price'):
+            return instance.total_price
         return sum(item.amount * item.product.price for item in instance.cartproduct_set.all())
 
     def get_total_amount(self, instance) -> int:
         '''Вычисление общего количества товаров в корзине.'''
+        if hasattr(instance, 'total_amount'):
+            return instance.total_amount
         return sum(item.amount for item in instance.cartproduct_set.all())
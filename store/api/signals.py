@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_changed_users, invalidate_token_cache
+from .cache import bump_catalog_version, bump_stock_version
+from products.models import (Product, ProductGroup, ProductImage, Type,
+                             User)
+from products.signals import catalog_changed, stock_changed
+
+CATALOG_MODELS = (ProductGroup, Type, Product, ProductImage)
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    '''
+    Сбрасывает кэш каталога при изменении любой из его моделей.
+    Версия меняется повторно после коммита, чтобы параллельные запросы
+    не закэшировали данные, прочитанные до коммита.
+    '''
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+def invalidate_stock(sender, **kwargs):
+    '''Меняет версию остатков после их изменения.'''
+    bump_stock_version()
+    transaction.on_commit(bump_stock_version)
+
+
+def invalidate_deleted_token(sender, instance, **kwargs):
+    '''Удаляет из кэша токен после выхода пользователя.'''
+    keys = [instance.key]
+    invalidate_token_cache(keys)
+    transaction.on_commit(lambda: invalidate_token_cache(keys))
+
+
+def invalidate_user_tokens(sender, instance, created, raw, **kwargs):
+    '''
+    Удаляет из кэша токены пользователя, если изменились данные
+    его снимка, например пароль или блокировка.
+    '''
+    if created or raw:
+        return
+    keys = list(Token.objects.filter(user=instance).values_list('key',
+                                                                flat=True))
+    if keys:
+        invalidate_changed_users(instance, keys)
+        transaction.on_commit(
+            lambda: invalidate_changed_users(instance, keys))
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog_cache, sender=model)
+    post_delete.connect(invalidate_catalog_cache, sender=model)
+
+catalog_changed.connect(invalidate_catalog_cache)
+stock_changed.connect(invalidate_stock)
+post_delete.connect(invalidate_deleted_token, sender=Token)
+post_save.connect(invalidate_user_tokens, sender=User)
@@ -1,8 +1,11 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter as Router
 
-from .views import (CartViewSet, CustomUserViewSet, ProductGroupViewSet,
-                    ProductViewSet, TypeViewSet)
+from .async_views import (AsyncProductGroupView, AsyncProductView,
+                          AsyncTypeView)
+from .views import (CartViewSet, CatalogExportView, CatalogView,
+                    CustomUserViewSet, ProductGroupViewSet, ProductViewSet,
+                    TypeViewSet)
 
 router_v1 = Router()
 router_v1.register('users', CustomUserViewSet, basename='user')
@@ -13,6 +16,20 @@ router_v1.register('cart', CartViewSet, basename='cart')
 
 
 urlpatterns = [
+    path('catalog/', CatalogView.as_view(), name='catalog'),
+    path('catalog/export/', CatalogExportView.as_view(),
+         name='catalog-export'),
+    path('async/groups/', AsyncProductGroupView.as_view(),
+         name='async-group-list'),
+    path('async/groups/<int:pk>/', AsyncProductGroupView.as_view(),
+         name='async-group-detail'),
+    path('async/types/', AsyncTypeView.as_view(), name='async-type-list'),
+    path('async/types/<int:pk>/', AsyncTypeView.as_view(),
+         name='async-type-detail'),
+    path('async/products/', AsyncProductView.as_view(),
+         name='async-product-list'),
+    path('async/products/<int:pk>/', AsyncProductView.as_view(),
+         name='async-product-detail'),
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,17 +1,32 @@
-from django.db import transaction
+import hashlib
+import time
+
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from djoser.views import UserViewSet
-from rest_framework import mixins, permissions, status, viewsets
+from rest_framework import exceptions, mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-
-from .permissions import IsAdminOrReadOnly
-from .serializers import (CartSerializer, ProductAddSerializer,
-                          ProductGroupReadSerializer, ProductGroupSerializer,
-                          ProductInCartSerializer, ProductReadSerializer,
-                          TypeSerializer)
+from rest_framework.views import APIView
+
+from .cache import get_catalog_version, get_stock_version
+from .catalog import get_catalog_snapshot
+from .export import iter_catalog_rows, stream_csv, stream_ndjson
+from .pagination import CatalogCursorPagination, CatalogPageNumberPagination
+from .permissions import IsAdmin, IsAdminOrReadOnly
+from .serializers import (CartBatchSerializer, CartSerializer,
+                          ProductAddSerializer, ProductGroupReadSerializer,
+                          ProductGroupSerializer, ProductInCartSerializer,
+                          ProductReadSerializer, TypeSerializer)
 from products.models import (Cart, CartProduct, Product, ProductGroup, Type,
                              User)
+from products.services import (apply_cart_operations, remove_from_cart,
+                               save_cart_product)
+from store.constans import MAX_CART_AMOUNT
 
 
 class CustomUserViewSet(UserViewSet):
@@ -19,7 +34,98 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
 
 
-class ProductGroupViewSet(viewsets.ModelViewSet):
+class CatalogPaginationMixin:
+    '''
+    Пагинация каталога: постраничная по умолчанию
+    и по курсору при запросе с параметром ?pagination=cursor.
+    '''
+    pagination_class = CatalogPageNumberPagination
+    cursor_pagination_class = CatalogCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+def get_catalog_validators(uri, media_type, versions, user_parts=()):
+    '''
+    ETag и время изменения ответа каталога по версиям данных,
+    адресу запроса, формату ответа и данным пользователя.
+    '''
+    parts = (*versions, uri, media_type, *user_parts)
+    etag = quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+    # Время изменения каталога не учитывает изменения корзины,
+    # поэтому для ответов, зависящих от пользователя, не отдается.
+    if user_parts:
+        return etag, None
+    # Last-Modified точен до секунды: время изменения округляется
+    # вверх и отдается только после наступления этой секунды, иначе
+    # следующее изменение в ту же секунду получило бы 304.
+    last_modified = max(versions) // 10 ** 9 + 1
+    if time.time() < last_modified:
+        last_modified = None
+    return etag, last_modified
+
+
+def add_conditional_headers(response, etag, last_modified):
+    if response.status_code in (status.HTTP_200_OK,
+                                status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+class ConditionalGetMixin:
+    '''
+    Отдает ETag и Last-Modified при чтении каталога по версии каталога
+    и отвечает 304 без сериализации, если данные у клиента актуальны.
+    '''
+
+    depends_on_stock = False
+
+    def get_user_etag_parts(self):
+        '''Данные пользователя, от которых зависит ответ.'''
+        return ()
+
+    def get_versions(self):
+        versions = [get_catalog_version()]
+        if self.depends_on_stock:
+            versions.append(get_stock_version())
+        return versions
+
+    def get_conditional_validators(self):
+        request = self.request
+        return get_catalog_validators(
+            request.build_absolute_uri(), request.accepted_media_type,
+            self.get_versions(), self.get_user_etag_parts())
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_conditional_validators()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return add_conditional_headers(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list,
+                                         request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve,
+                                         request, *args, **kwargs)
+
+
+class ProductGroupViewSet(ConditionalGetMixin, CatalogPaginationMixin,
+                          viewsets.ModelViewSet):
     '''
     ViewSet для создания, чтения, редактирования и удаления
     продуктовой категории.
@@ -33,29 +139,104 @@ class ProductGroupViewSet(viewsets.ModelViewSet):
         return ProductGroupSerializer
 
 
-class TypeViewSet(viewsets.ModelViewSet):
+class TypeViewSet(ConditionalGetMixin, CatalogPaginationMixin,
+                  viewsets.ModelViewSet):
     '''
     ViewSet для создания, чтения, редактирования и удаления
     подкатегории продуктов.
     '''
-    queryset = Type.objects.all()
+    queryset = Type.objects.select_related('product_group')
     permission_classes = (IsAdminOrReadOnly,)
     serializer_class = TypeSerializer
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CatalogPaginationMixin,
+                     viewsets.ModelViewSet):
     '''
     ViewSet для создания, чтения, редактирования и удаления
     продуктов.
     '''
-    queryset = Product.objects.all()
+    queryset = Product.objects.with_stock().select_related(
+        'type__product_group').prefetch_related('images')
     permission_classes = (IsAdminOrReadOnly,)
+    depends_on_stock = True
 
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
             return ProductReadSerializer
         return ProductAddSerializer
 
+    def get_cart_product_ids(self):
+        '''
+        Загружает id товаров из корзины пользователя один раз на запрос,
+        чтобы не проверять корзину отдельно для каждого продукта.
+        '''
+        if not hasattr(self, '_cart_product_ids'):
+            self._cart_product_ids = set(
+                CartProduct.objects.filter(
+                    cart__user=self.request.user
+                ).values_list('product_id', flat=True)
+            )
+        return self._cart_product_ids
+
+    def get_user_etag_parts(self):
+        if self.request.user.is_anonymous:
+            return ()
+        return (sorted(self.get_cart_product_ids()),)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if (self.request.method in permissions.SAFE_METHODS
+                and not self.request.user.is_anonymous):
+            context['cart_product_ids'] = self.get_cart_product_ids()
+        return context
+
+
+class CatalogView(ConditionalGetMixin, APIView):
+    '''
+    Дерево каталога одним запросом: категории, их подкатегории
+    и, с параметром ?products=true, краткие данные товаров.
+    '''
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        return self.conditional_response(self.get_tree, request)
+
+    def get_tree(self, request):
+        with_products = request.query_params.get('products') in ('1', 'true')
+        return Response(
+            get_catalog_snapshot().render(request, with_products))
+
+
+class CatalogExportView(APIView):
+    '''
+    Выгрузка всего каталога для партнеров в формате NDJSON
+    или, с параметром ?output=csv, в CSV. Ответ отдается потоком
+    по мере чтения продуктов из базы данных.
+    '''
+    permission_classes = (IsAdmin,)
+    outputs = {
+        'ndjson': (stream_ndjson, 'application/x-ndjson', 'ndjson'),
+        'csv': (stream_csv, 'text/csv; charset=utf-8', 'csv'),
+    }
+
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.outputs:
+            return Response(
+                {'error': 'Поддерживаются форматы: '
+                          f'{", ".join(self.outputs)}.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        stream, content_type, extension = self.outputs[output]
+        response = StreamingHttpResponse(stream(iter_catalog_rows()),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="catalog.{extension}"')
+        # nginx не буферизует ответ и сразу передает первые строки.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 
 class CartViewSet(mixins.CreateModelMixin,
                   mixins.ListModelMixin,
@@ -70,13 +251,20 @@ class CartViewSet(mixins.CreateModelMixin,
     http_method_names = ['get', 'post', 'delete', 'patch']
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return Cart.objects.filter(
+            user=self.request.user).select_related('user').with_totals()
+
+    def get_cart(self):
+        '''Корзина пользователя, создается не больше одного раза за запрос.'''
+        if not hasattr(self, '_cart'):
+            self._cart = Cart.objects.get_or_create(
+                user=self.request.user)[0]
+        return self._cart
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         if self.action in ['create', 'update', 'partial_update']:
-            context['cart'] = Cart.objects.get_or_create(
-                user=self.request.user)[0]
+            context['cart'] = self.get_cart()
         return context
 
     def create(self, request, *args, **kwargs):
@@ -89,6 +277,25 @@ class CartViewSet(mixins.CreateModelMixin,
         return Response({'detail': 'Товар добавлен в корзину.'},
                         status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        '''
+        Пакетное изменение корзины: добавление товаров, установка
+        количества и удаление в одном запросе и одной транзакции.
+        '''
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = self.get_cart()
+        try:
+            apply_cart_operations(cart,
+                                  serializer.validated_data['operations'])
+        except ValidationError as error:
+            raise exceptions.ValidationError(error.messages)
+        return Response(
+            CartSerializer(self.get_queryset().get(pk=cart.pk),
+                           context=self.get_serializer_context()).data,
+            status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['delete'], url_path='remove-product')
     def remove_product(self, request):
         '''
@@ -101,16 +308,10 @@ class CartViewSet(mixins.CreateModelMixin,
             return Response({'error': 'Необходимо указать имя товара.'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        product = get_object_or_404(Product, name=product_name)
-        cart = get_object_or_404(Cart, user=user)
         cart_product = get_object_or_404(CartProduct,
-                                         cart=cart,
-                                         product=product)
-
-        with transaction.atomic():
-            product.in_stock += cart_product.amount
-            cart_product.delete()
-            product.save()
+                                         cart__user=user,
+                                         product__name=product_name)
+        remove_from_cart(cart_product)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -126,11 +327,8 @@ class CartViewSet(mixins.CreateModelMixin,
             return Response('Ваша корзина уже пустая.',
                             status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            for cart_product in cart.cartproduct_set.all():
-                cart_product.product.in_stock += cart_product.amount
-                cart_product.product.save()
-            cart.delete()
+        # Товары возвращаются на склад обработчиком удаления корзины.
+        cart.delete()
 
         return Response('Корзина очищена.', status=status.HTTP_204_NO_CONTENT)
 
@@ -149,26 +347,27 @@ class CartViewSet(mixins.CreateModelMixin,
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        cart = get_object_or_404(Cart, user=user)
-        cart_product = get_object_or_404(
-            CartProduct, cart=cart, product__name=product_name)
-
-        product = cart_product.product
-
-        diff = new_amount - cart_product.amount
-        if diff > product.in_stock:
-            return Response(
-                f'Недостаточно товара на складе. '
-                f'Доступно: {product.in_stock}.',
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        with transaction.atomic():
-            cart_product.amount = new_amount
-            cart_product.save()
+        try:
+            new_amount = int(new_amount)
+        except (TypeError, ValueError):
+            new_amount = 0
+        if new_amount < 1:
+            return Response('Количество должно быть больше 0.',
+                            status=status.HTTP_400_BAD_REQUEST)
+        if new_amount > MAX_CART_AMOUNT:
+            return Response(f'Количество должно быть не больше '
+                            f'{MAX_CART_AMOUNT}.',
+                            status=status.HTTP_400_BAD_REQUEST)
 
-            product.in_stock -= diff
-            product.save()
+        cart_product = get_object_or_404(
+            CartProduct.objects.select_related('product'),
+            cart__user=user, product__name=product_name)
+        cart_product.amount = new_amount
+        try:
+            save_cart_product(cart_product)
+        except ValidationError as error:
+            return Response(error.messages[0],
+                            status=status.HTTP_400_BAD_REQUEST)
 
         return Response(
             f'Количество товара {product_name} обновлено до {new_amount}.',
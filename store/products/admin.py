@@ -1,8 +1,13 @@
 from django.contrib import admin
+from django.db import transaction
 
 from .models import (Cart, CartProduct, Product, ProductGroup, ProductImage,
                      Type)
+from .receivers import cart_stock_released
+from .services import (release_cart_products, remove_from_cart,
+                       save_cart_product, set_stock_shards)
 from store.constans import EMPTY_VALUE, MIN_NUM
+from store.paginator import EstimatedCountPaginator
 
 
 class CartProductInline(admin.TabularInline):
@@ -10,8 +15,12 @@ class CartProductInline(admin.TabularInline):
     autocomplete_fields = ('product',)
     extra = MIN_NUM
     min_num = MIN_NUM
-    readonly_fields = ('product_price', 'total_price')
-    fields = ('product', 'amount', 'product_price', 'total_price')
+    readonly_fields = ('product_price', 'total_price', 'reserved_at')
+    fields = ('product', 'amount', 'product_price', 'total_price',
+              'reserved_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
     @admin.display(description='Цена за 1 шт')
     def product_price(self, obj):
@@ -49,22 +58,52 @@ class TypeAdmin(admin.ModelAdmin):
                     'product_group', 'image')
     search_fields = ('name', 'product_group__name')
     list_filter = ('product_group',)
+    list_select_related = ('product_group',)
     empty_value_display = EMPTY_VALUE
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'product_group', 'type',
-                    'slug', 'price', 'in_stock')
+                    'slug', 'price', 'total_in_stock', 'stock_shards')
     search_fields = ('name', 'slug')
     list_filter = ('type__product_group', 'type')
+    list_select_related = ('type__product_group',)
     inlines = (ProductImageInline,)
     empty_value_display = EMPTY_VALUE
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    @admin.display(description='Категория')
+    @admin.display(description='Категория',
+                   ordering='type__product_group__name')
     def product_group(self, obj):
         '''Отображает категорию в списке продуктов.'''
-        return obj.product_group.name
+        return obj.type.product_group.name
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stock()
+
+    @admin.display(description='Остаток в магазине',
+                   ordering='total_in_stock')
+    def total_in_stock(self, obj):
+        return obj.total_in_stock
+
+    def save_model(self, request, obj, form, change):
+        '''
+        Новый остаток и число частей остатка записываются через
+        set_stock_shards: остаток делится между частями.
+        '''
+        stock_fields = {'in_stock', 'stock_shards'} & set(form.changed_data)
+        shards = obj.stock_shards
+        in_stock = obj.in_stock if 'in_stock' in stock_fields else None
+        if change:
+            obj.stock_shards = form.initial['stock_shards']
+            obj.in_stock = form.initial['in_stock']
+        else:
+            obj.stock_shards = 1
+        super().save_model(request, obj, form, change)
+        if stock_fields:
+            set_stock_shards(obj, shards, in_stock)
 
 
 @admin.register(Cart)
@@ -73,16 +112,41 @@ class CartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'display_products',
                     'total_amount', 'total_price')
     search_fields = ('user__username',)
+    list_select_related = ('user',)
     empty_value_display = EMPTY_VALUE
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        '''Итоги и состав корзин считаются в запросе списка.'''
+        return super().get_queryset(request).with_summary()
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        '''Возвращает на склад товары всех удаляемых корзин разом.'''
+        release_cart_products(CartProduct.objects.filter(cart__in=queryset))
+        with cart_stock_released():
+            super().delete_queryset(request, queryset)
+
+    def save_formset(self, request, form, formset, change):
+        '''Изменяет остатки на складе при редактировании корзины.'''
+        if formset.model is not CartProduct:
+            return super().save_formset(request, form, formset, change)
+        cart_products = formset.save(commit=False)
+        for cart_product in formset.deleted_objects:
+            remove_from_cart(cart_product)
+        for cart_product in cart_products:
+            save_cart_product(cart_product)
 
     @admin.display(description='Продукты')
     def display_products(self, cart):
-        return ', '.join([product.name for product in cart.products.all()])
+        return cart.product_names
 
-    @admin.display(description='Итоговая стоимость')
+    @admin.display(description='Итоговая стоимость', ordering='total_price')
     def total_price(self, cart):
-        return sum(item.amount * item.product.price for item in cart.cartproduct_set.all())
+        return cart.total_price
 
-    @admin.display(description='Количество товаров в корзине')
+    @admin.display(description='Количество товаров в корзине',
+                   ordering='total_amount')
     def total_amount(self, cart):
-        return sum(item.amount for item in cart.cartproduct_set.all())
+        return cart.total_amount
@@ -0,0 +1,331 @@
+'''
+Нагрузочный тест приложения без внешнего HTTP-сервера.
+Запросы выполняются тестовым клиентом Django в нескольких потоках,
+для каждого запроса замеряются время ответа и число SQL-запросов.
+'''
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+
+from .models import Product, Type
+from .scale_data import USERNAME, ScaleData
+from store.middleware import QueryRecorder
+
+IN_STOCK = 30000
+PAGE_SIZE = 10
+
+# Доля запросов к корзине в каждом сценарии.
+WORKLOADS = {
+    'browse': 0.0,
+    'cart': 1.0,
+    'mixed': 0.2,
+    'hot': 1.0,
+}
+# В сценарии hot все покупатели работают с одним продуктом,
+# как во время распродажи.
+HOT_WORKLOADS = ('hot',)
+
+
+@contextmanager
+def benchmark_database(keepdb=False, using=DEFAULT_DB_ALIAS):
+    '''
+    Отдельная тестовая база данных на время бенчмарка. С keepdb
+    база и ее данные сохраняются для следующего запуска.
+    '''
+    connection = connections[using]
+    setup_test_environment()
+    # Потоки не видят базу SQLite в памяти, поэтому база - файл.
+    test_settings = connection.settings_dict['TEST']
+    if connection.vendor == 'sqlite' and not test_settings['NAME']:
+        test_settings['NAME'] = os.path.join(settings.BASE_DIR,
+                                             'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0,
+                                            keepdb=keepdb)
+        teardown_test_environment()
+
+
+def create_dataset(products, users, seed, using=DEFAULT_DB_ALIAS):
+    '''
+    Создает тем же генератором, что и команда generate_scale_data,
+    каталог из products продуктов и users пользователей с токенами
+    и корзинами. Остатков хватает на все запросы бенчмарка.
+    '''
+    ScaleData(groups=max(1, products // 100), types=max(1, products // 10),
+              products=products, images=3, users=users, cart_products=5,
+              seed=seed, using=using, in_stock=IN_STOCK).generate(
+                  batch_size=10000)
+
+
+def get_tokens(seed):
+    '''Токены пользователей, созданных с seed, по их номерам.'''
+    prefix = f'{USERNAME}{seed}-'
+    return {
+        int(username[len(prefix):]): key
+        for key, username in Token.objects.filter(
+            user__username__startswith=prefix
+        ).values_list('key', 'user__username')
+    }
+
+
+class Workload:
+    '''
+    Генератор запросов одного сценария. Последовательность запросов
+    пользователя зависит только от seed и номера пользователя,
+    поэтому не меняется от запуска к запуску.
+    '''
+
+    def __init__(self, name, seed):
+        self.cart_share = WORKLOADS[name]
+        self.seed = seed
+        self.products = list(Product.objects.order_by('pk').values_list(
+            'pk', 'name'))
+        if name in HOT_WORKLOADS:
+            self.products = self.products[:1]
+        self.type_ids = list(Type.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        self.product_pages = math.ceil(len(self.products) / PAGE_SIZE)
+        self.type_pages = math.ceil(len(self.type_ids) / PAGE_SIZE)
+
+    def generate(self, users, count):
+        '''Список из count запросов, распределенных по users.'''
+        requests = []
+        for user in range(users):
+            rng = random.Random(f'{self.seed}:{user}')
+            cart = {}
+            for _ in range(count // users + (user < count % users)):
+                if rng.random() < self.cart_share:
+                    request = self.cart_request(rng, cart)
+                else:
+                    request = self.browse_request(rng)
+                requests.append({'user': user, **request})
+        return requests
+
+    def browse_request(self, rng):
+        choice = rng.random()
+        if choice < 0.4:
+            page = rng.randint(1, self.product_pages)
+            return {'method': 'get', 'path': f'/api/products/?page={page}'}
+        if choice < 0.7:
+            pk, _ = rng.choice(self.products)
+            return {'method': 'get', 'path': f'/api/products/{pk}/'}
+        if choice < 0.8:
+            page = rng.randint(1, self.type_pages)
+            return {'method': 'get', 'path': f'/api/types/?page={page}'}
+        if choice < 0.9:
+            return {'method': 'get', 'path': '/api/groups/'}
+        return {'method': 'get', 'path': '/api/catalog/'}
+
+    def cart_request(self, rng, cart):
+        '''
+        Запрос к корзине, допустимый для ее текущего состава:
+        cart - товары в корзине пользователя и их количество.
+        '''
+        choice = rng.random()
+        if choice < 0.3:
+            return {'method': 'get', 'path': '/api/cart/'}
+        if choice < 0.6 or not cart:
+            _, name = rng.choice(self.products)
+            amount = rng.randint(1, 3)
+            cart[name] = cart.get(name, 0) + amount
+            return {'method': 'post', 'path': '/api/cart/',
+                    'data': {'product': name, 'amount': amount}}
+        name = rng.choice(list(cart))
+        if choice < 0.85:
+            cart[name] = rng.randint(1, 5)
+            return {'method': 'patch', 'path': '/api/cart/update-product/',
+                    'data': {'product': name, 'amount': cart[name]}}
+        del cart[name]
+        return {'method': 'delete', 'path': '/api/cart/remove-product/',
+                'data': {'product': name}}
+
+
+def read_requests(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def write_requests(path, requests):
+    with open(path, 'w', encoding='utf-8') as file:
+        for request in requests:
+            file.write(json.dumps(request, ensure_ascii=False) + '\n')
+
+
+def get_endpoint(request):
+    '''Метка запроса для отчета: метод и имя маршрута.'''
+    path = request['path'].partition('?')[0]
+    try:
+        view_name = resolve(path).view_name
+    except Resolver404:
+        view_name = path
+    return f'{request["method"].upper()} {view_name}'
+
+
+def send(client, request):
+    if request['method'] == 'get':
+        return client.get(request['path'])
+    return client.generic(request['method'].upper(), request['path'],
+                          json.dumps(request.get('data', {})),
+                          content_type='application/json')
+
+
+def run_requests(requests, tokens):
+    '''
+    Выполняет запросы по порядку и возвращает замеры
+    (метка, время в секундах, число SQL-запросов, код ответа).
+    '''
+    clients = {}
+    samples = []
+    try:
+        for request in requests:
+            user = request.get('user')
+            if user not in clients:
+                headers = {}
+                if user in tokens:
+                    headers['HTTP_AUTHORIZATION'] = f'Token {tokens[user]}'
+                clients[user] = Client(raise_request_exception=False,
+                                       **headers)
+            recorder = QueryRecorder()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                started = time.perf_counter()
+                response = send(clients[user], request)
+                duration = time.perf_counter() - started
+            samples.append((get_endpoint(request), duration,
+                            len(recorder.statements), response.status_code))
+    finally:
+        connections.close_all()
+    return samples
+
+
+def run(requests, tokens, concurrency):
+    '''
+    Выполняет запросы в concurrency потоках. Запросы одного
+    пользователя выполняются одним потоком в исходном порядке.
+    Возвращает замеры и общее время.
+    '''
+    queues = [[] for _ in range(concurrency)]
+    for request in requests:
+        queues[(request.get('user') or 0) % concurrency].append(request)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(run_requests, queues,
+                                    [tokens] * concurrency))
+    duration = time.perf_counter() - started
+    return [sample for samples in results for sample in samples], duration
+
+
+def percentile(values, percent):
+    '''Перцентиль отсортированного списка методом ближайшего ранга.'''
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize_samples(samples, duration):
+    latencies = sorted(sample[1] for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(sample[3] >= 400 for sample in samples),
+        'rps': round(len(samples) / duration, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries': round(sum(sample[2] for sample in samples)
+                         / len(samples), 2),
+    }
+
+
+def summarize(samples, duration):
+    '''Сводка по всем запросам и по каждому эндпоинту.'''
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+    return {
+        'total': summarize_samples(samples, duration),
+        'endpoints': {
+            endpoint: summarize_samples(endpoint_samples, duration)
+            for endpoint, endpoint_samples in sorted(by_endpoint.items())
+        },
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result):
+    '''Строки отчета о результате по каждому эндпоинту.'''
+    yield (f'{"":40} {"запросы":>8} {"ошибки":>7} {"rps":>8} '
+           f'{"p50, мс":>8} {"p95, мс":>8} {"p99, мс":>8} {"SQL":>6}')
+    rows = [('total', result['total']), *result['endpoints'].items()]
+    for name, row in rows:
+        yield (f'{name[:40]:40} {row["requests"]:>8} {row["errors"]:>7} '
+               f'{row["rps"]:>8} {row["p50_ms"]:>8} {row["p95_ms"]:>8} '
+               f'{row["p99_ms"]:>8} {row["queries"]:>6}')
+
+
+def shards_report(results):
+    '''
+    Строки отчета о пропускной способности в зависимости
+    от числа частей остатка продуктов.
+    '''
+    yield (f'{"частей":>7} {"rps":>8} {"p95, мс":>8} {"p99, мс":>8} '
+           f'{"ошибки":>7}')
+    for result in results:
+        row = result['total']
+        yield (f'{result["stock_shards"]:>7} {row["rps"]:>8} '
+               f'{row["p95_ms"]:>8} {row["p99_ms"]:>8} {row["errors"]:>7}')
+
+
+def compare(base, new):
+    '''
+    Строки отчета о разнице двух результатов: для каждого эндпоинта
+    запросы в секунду, p95 и число SQL-запросов до и после.
+    '''
+    def change(old, value):
+        if not old:
+            return ''
+        return f'{(value - old) / old * 100:+.1f}%'
+
+    yield f'{"":40} {"rps":>23} {"p95, мс":>25} {"SQL":>12}'
+    names = ['total'] + sorted(set(base['endpoints']) | set(new['endpoints']))
+    for name in names:
+        if name == 'total':
+            old, value = base['total'], new['total']
+        else:
+            old = base['endpoints'].get(name)
+            value = new['endpoints'].get(name)
+        if old is None or value is None:
+            yield f'{name[:40]:40} есть только в одном из результатов'
+            continue
+        yield (
+            f'{name[:40]:40} '
+            f'{old["rps"]:>7} {value["rps"]:>7} '
+            f'{change(old["rps"], value["rps"]):>7} '
+            f'{old["p95_ms"]:>8} {value["p95_ms"]:>8} '
+            f'{change(old["p95_ms"], value["p95_ms"]):>7} '
+            f'{old["queries"]:>5} {value["queries"]:>6}'
+        )
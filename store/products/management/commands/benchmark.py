@@ -0,0 +1,166 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.benchmark import (WORKLOADS, Workload, benchmark_database,
+                                compare, create_dataset, get_commit,
+                                get_tokens, read_requests, report, run,
+                                shards_report, summarize, write_requests)
+from products.models import Product
+from products.services import set_stock_shards
+from store.constans import MAX_STOCK_SHARDS
+
+
+class Command(BaseCommand):
+    '''
+    Нагрузочный тест в отдельной тестовой базе данных: создает
+    синтетический каталог, выполняет сценарий или записанные
+    запросы в несколько потоков и выводит запросы в секунду,
+    p50/p95/p99 и число SQL-запросов по каждому эндпоинту.
+    Результаты сохраняются в JSON для сравнения двух коммитов.
+    С --stock-shards запросы повторяются для каждого числа частей
+    остатка продуктов сценария.
+    '''
+    help = 'Нагрузочный тест API на синтетических данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workload', choices=sorted(WORKLOADS),
+                            default='mixed',
+                            help='Сценарий: просмотр каталога, корзина, '
+                                 'их смесь или корзины с одним '
+                                 'продуктом (hot).')
+        parser.add_argument('--replay',
+                            help='JSONL-файл с запросами вместо сценария.')
+        parser.add_argument('--record',
+                            help='Сохранить запросы сценария в JSONL-файл.')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Число запросов.')
+        parser.add_argument('--warmup', type=int, default=200,
+                            help='Число запросов для прогрева, '
+                                 'не входящих в результат.')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Число потоков.')
+        parser.add_argument('--products', type=int, default=1000,
+                            help='Число продуктов в каталоге.')
+        parser.add_argument('--stock-shards', nargs='+', type=int,
+                            metavar='N',
+                            help='Разделить остаток продуктов сценария '
+                                 'на N частей, для нескольких N тест '
+                                 'повторяется.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Не удалять тестовую базу данных '
+                                 'и использовать ее данные повторно.')
+        parser.add_argument('--output', help='Сохранить результат в JSON.')
+        parser.add_argument('--compare', nargs='+', metavar='RESULT',
+                            help='Сравнить результат с сохраненным. '
+                                 'С двумя файлами тест не запускается.')
+
+    def handle(self, *args, **options):
+        if options['compare'] and len(options['compare']) > 2:
+            raise CommandError('Для сравнения нужно один или два файла.')
+        if options['compare'] and len(options['compare']) == 2:
+            base, new = map(self.load_result, options['compare'])
+            self.write_comparison(base, new)
+            return
+        self.check_stock_shards(options)
+        base = None
+        if options['compare']:
+            base = self.load_result(options['compare'][0])
+
+        results = self.benchmark(options)
+        self.write_results(results, options['stock_shards'])
+        result = results[-1]
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(result, file, ensure_ascii=False, indent=2)
+        if base is not None:
+            self.write_comparison(base, result)
+
+    def check_stock_shards(self, options):
+        shard_counts = options['stock_shards'] or ()
+        if len(shard_counts) > 1 and (options['output']
+                                      or options['compare']):
+            raise CommandError('--output и --compare работают только '
+                               'с одним значением --stock-shards.')
+        if any(not 1 <= shards <= MAX_STOCK_SHARDS
+               for shards in shard_counts):
+            raise CommandError(f'--stock-shards должно быть от 1 '
+                               f'до {MAX_STOCK_SHARDS}.')
+
+    def write_results(self, results, shard_counts):
+        for result in results:
+            if shard_counts:
+                self.stdout.write(
+                    f'Частей остатка: {result["stock_shards"]}')
+            for line in report(result):
+                self.stdout.write(line)
+        if len(results) > 1:
+            for line in shards_report(results):
+                self.stdout.write(line)
+
+    def benchmark(self, options):
+        with benchmark_database(keepdb=options['keepdb']):
+            return self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        requests = None
+        users = options['concurrency']
+        if options['replay']:
+            requests = read_requests(options['replay'])
+            users = max([users] + [request['user'] + 1
+                                   for request in requests
+                                   if request.get('user') is not None])
+        if not get_tokens(options['seed']):
+            create_dataset(options['products'], users, options['seed'])
+        tokens = get_tokens(options['seed'])
+        if len(tokens) < users:
+            raise CommandError(
+                f'В сохраненной базе {len(tokens)} пользователей, '
+                f'нужно {users}. Запустите тест без --keepdb.')
+
+        workload = Workload(options['workload'], options['seed'])
+        if requests is None:
+            requests = workload.generate(users, options['requests'])
+        if options['record']:
+            write_requests(options['record'], requests)
+        if options['warmup']:
+            warmup = Workload('browse', -options['seed'])
+            run(warmup.generate(users, options['warmup']), tokens,
+                options['concurrency'])
+
+        results = []
+        for shards in options['stock_shards'] or (None,):
+            if shards is not None:
+                for product in Product.objects.filter(
+                        pk__in=[pk for pk, _ in workload.products]):
+                    set_stock_shards(product, shards)
+            samples, duration = run(requests, tokens,
+                                    options['concurrency'])
+            results.append({
+                'commit': get_commit(),
+                'database': connection.vendor,
+                'workload': ('replay' if options['replay']
+                             else options['workload']),
+                'products': len(workload.products),
+                'concurrency': options['concurrency'],
+                'stock_shards': shards,
+                'seed': options['seed'],
+                'duration': round(duration, 3),
+                **summarize(samples, duration),
+            })
+        return results
+
+    def load_result(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+
+    def write_comparison(self, base, new):
+        self.stdout.write(f'Сравнение {base.get("commit")} '
+                          f'и {new.get("commit")}:')
+        for line in compare(base, new):
+            self.stdout.write(line)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import time
+from importlib.util import find_spec
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+
+DEFAULT_CATALOG = os.path.join('products', 'fixtures', 'catalog.csv')
+
+
+def hash_files(files):
+    '''Отпечаток содержимого файлов, files - пары (имя, путь).'''
+    digest = hashlib.sha256()
+    for name, path in sorted(files):
+        digest.update(name.encode())
+        with open(path, 'rb') as file:
+            while chunk := file.read(64 * 1024):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def migration_files():
+    for app_config in apps.get_app_configs():
+        module_name, _ = MigrationLoader.migrations_module(app_config.label)
+        spec = find_spec(module_name) if module_name else None
+        if spec is None or not spec.submodule_search_locations:
+            continue
+        for directory in spec.submodule_search_locations:
+            for name in os.listdir(directory):
+                if name.endswith('.py'):
+                    yield (f'{app_config.label}/{name}',
+                           os.path.join(directory, name))
+
+
+def static_files():
+    for finder in get_finders():
+        for path, storage in finder.list([]):
+            yield path, storage.path(path)
+
+
+class Command(BaseCommand):
+    '''
+    Подготавливает приложение к запуску: применяет миграции, создает
+    админа, импортирует каталог и собирает статику.
+    Шаг пропускается, если отпечаток его исходных данных совпадает
+    с записанным при прошлом запуске в файле BOOTSTRAP_STATE_FILE.
+    После применения миграций шаги, работающие с базой данных,
+    выполняются заново.
+    '''
+    help = 'Запуск приложения без повторного выполнения неизмененных шагов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalog', default=DEFAULT_CATALOG,
+                            help='Файл каталога для import_catalog.')
+        parser.add_argument('--force', action='store_true',
+                            help='Выполнить все шаги.')
+
+    def handle(self, *args, **options):
+        self.state_file = settings.BOOTSTRAP_STATE_FILE
+        self.state = self.load_state()
+        started = time.monotonic()
+
+        migrated = self.run_step(
+            'migrate', self.migrations_fingerprint,
+            lambda: call_command('migrate', interactive=False,
+                                 verbosity=0),
+            force=options['force'])
+        force = options['force'] or migrated
+        self.run_step(
+            'initadmin',
+            lambda: hashlib.sha256(
+                os.getenv('USERNAME_ADMIN', '').encode()).hexdigest(),
+            lambda: call_command('initadmin'),
+            force=force)
+        self.run_step(
+            'import_catalog',
+            lambda: hash_files([('catalog', options['catalog'])]),
+            lambda: call_command('import_catalog', options['catalog'],
+                                 stdout=self.stdout),
+            force=force)
+        self.run_step(
+            'collectstatic',
+            lambda: hash_files(static_files()),
+            lambda: call_command('collectstatic', interactive=False,
+                                 verbosity=0),
+            force=options['force'] or not self.static_root_is_filled())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Подготовка завершена за {time.monotonic() - started:.3f} с'))
+
+    def run_step(self, name, fingerprint, action, force=False) -> bool:
+        '''Выполняет шаг, если изменился его отпечаток.'''
+        started = time.monotonic()
+        ran = force or self.state.get(name) != fingerprint()
+        if ran:
+            action()
+            self.state[name] = fingerprint()
+            self.save_state()
+        self.stdout.write(
+            f'{name}: {"выполнено" if ran else "пропущено"} '
+            f'за {time.monotonic() - started:.3f} с')
+        return ran
+
+    @staticmethod
+    def migrations_fingerprint():
+        '''
+        Отпечаток файлов миграций и числа примененных миграций:
+        новая база данных без таблиц тоже меняет отпечаток.
+        '''
+        applied = MigrationRecorder(
+            connections[DEFAULT_DB_ALIAS]).applied_migrations()
+        return f'{hash_files(migration_files())}:{len(applied)}'
+
+    @staticmethod
+    def static_root_is_filled():
+        return (os.path.isdir(settings.STATIC_ROOT)
+                and bool(os.listdir(settings.STATIC_ROOT)))
+
+    def load_state(self):
+        try:
+            with open(self.state_file, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = f'{self.state_file}.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file)
+        os.replace(temp_file, self.state_file)
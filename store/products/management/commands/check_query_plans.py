@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.benchmark import benchmark_database
+from products.models import Product
+from products.query_plans import hot_queries, plan_problems
+from products.scale_data import USERNAME, ScaleData
+from users.models import User
+
+
+class Command(BaseCommand):
+    '''
+    Создает в отдельной тестовой базе данных каталог заданного
+    размера, собирает статистику и проверяет EXPLAIN частых запросов.
+    Команда завершается ошибкой, если запрос читает целиком таблицу
+    или сортирует без индекса больше --min-rows строк.
+    '''
+    help = 'Проверка планов частых запросов на больших данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000,
+                            help='Число продуктов в каталоге.')
+        parser.add_argument('--users', type=int, default=10000,
+                            help='Число пользователей с корзинами.')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Меньшие таблицы можно читать целиком '
+                                 'и сортировать.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Не удалять тестовую базу данных '
+                                 'и использовать ее данные повторно.')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']) as connection:
+            seed = options['seed']
+            if not User.objects.filter(
+                    username=f'{USERNAME}{seed}-0').exists():
+                products = options['products']
+                ScaleData(
+                    groups=max(1, products // 2000),
+                    types=max(1, products // 100), products=products,
+                    images=3, users=options['users'], cart_products=5,
+                    seed=seed, using=connection.alias,
+                ).generate(batch_size=10000)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            failed = self.check_plans(
+                User.objects.get(username=f'{USERNAME}{seed}-0'),
+                Product.objects.select_related('type__product_group').get(
+                    slug=f'product-{seed}-0'),
+                options['min_rows'])
+        if failed:
+            raise CommandError(
+                f'Запросы без подходящих индексов: {", ".join(failed)}.')
+        self.stdout.write(self.style.SUCCESS(
+            'Все запросы используют индексы.'))
+
+    def check_plans(self, user, product, min_rows):
+        failed = []
+        for name, queryset in hot_queries(user, product).items():
+            problems = plan_problems(queryset, min_rows)
+            if problems:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: {", ".join(problems)}'))
+                self.stdout.write(queryset.explain())
+            else:
+                self.stdout.write(f'{name}: OK')
+        return failed
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from products.scale_data import ScaleData
+
+
+class Command(BaseCommand):
+    '''
+    Создает синтетический каталог, пользователей с токенами
+    и заполненные корзины для проверки на объемах продакшена.
+    '''
+    help = 'Генерация синтетических данных каталога, пользователей и корзин.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=50,
+                            help='Число категорий.')
+        parser.add_argument('--types', type=int, default=1000,
+                            help='Число подкатегорий.')
+        parser.add_argument('--products', type=int, default=100000,
+                            help='Число продуктов.')
+        parser.add_argument('--images', type=int, default=3,
+                            help='Наибольшее число изображений продукта.')
+        parser.add_argument('--users', type=int, default=10000,
+                            help='Число пользователей с токенами '
+                                 'и корзинами.')
+        parser.add_argument('--cart-products', type=int, default=5,
+                            help='Наибольшее число товаров в корзине.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Число строк в одной записи в базу.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        for name in ('groups', 'types', 'images', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} '
+                                   f'должно быть больше 0.')
+        data = ScaleData(
+            groups=options['groups'], types=options['types'],
+            products=options['products'], images=options['images'],
+            users=options['users'], cart_products=options['cart_products'],
+            seed=options['seed'], using=options['database'])
+        if data.exists():
+            raise CommandError(
+                f'Данные с seed {options["seed"]} уже созданы.')
+
+        started = time.monotonic()
+        total = 0
+
+        def progress(model, count, elapsed):
+            nonlocal total
+            total += count
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {count} строк '
+                f'за {elapsed:.1f} с ({count / max(elapsed, 1e-9):.0f} '
+                f'строк/с)')
+
+        data.generate(options['batch_size'], progress)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано {total} строк за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} строк/с).'))
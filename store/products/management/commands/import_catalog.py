@@ -0,0 +1,292 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from products.models import Product, ProductGroup, ProductImage, Type
+from products.renditions import render_missing_thumbnails
+from products.services import set_stock_shards
+from products.signals import catalog_changed
+
+GROUP_FIELDS = ('slug', 'image')
+TYPE_FIELDS = ('slug', 'image', 'product_group_id')
+PRODUCT_FIELDS = ('slug', 'type_id', 'price', 'in_stock')
+INT_COLUMNS = ('price', 'in_stock')
+IMAGES_SEPARATOR = '|'
+
+
+class Command(BaseCommand):
+    '''
+    Импортирует каталог из файла CSV или JSON Lines.
+    Каждая строка описывает продукт вместе с его подкатегорией
+    и категорией: group, group_slug, group_image, type, type_slug,
+    type_image, name, slug, price, in_stock, images.
+    Строка без name создает или обновляет только категорию
+    и подкатегорию. Изображения в CSV разделяются символом "|".
+    Объекты сопоставляются по названию, неизмененные строки
+    не записываются в базу данных. Слаг, занятый объектом
+    с другим названием, - ошибка строки.
+    '''
+    help = 'Импортирует каталог продуктов из CSV или JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу, "-" - stdin.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Формат файла, по умолчанию - '
+                                 'по расширению.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--update-stock', action='store_true',
+                            help='Перезаписать остатки существующих '
+                                 'продуктов. По умолчанию остатки '
+                                 'задаются только новым продуктам.')
+        parser.add_argument('--thumbnails', action='store_true',
+                            help='Создать недостающие миниатюры.')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or (
+            'jsonl' if options['path'].endswith('.jsonl')
+            else 'csv')
+        self.update_stock = options['update_stock']
+        self.groups = {
+            group.pop('name'): group
+            for group in ProductGroup.objects.values('id', 'name',
+                                                     *GROUP_FIELDS)
+        }
+        self.types = {
+            type_data.pop('name'): type_data
+            for type_data in Type.objects.values('id', 'name', *TYPE_FIELDS)
+        }
+        self.stats = dict.fromkeys(
+            ('groups', 'types', 'products', 'images_added',
+             'images_removed'), 0)
+
+        total = 0
+        started = time.monotonic()
+        with self.open(options['path']) as file:
+            rows = self.read(file, file_format)
+            while batch := list(islice(rows, options['batch_size'])):
+                with transaction.atomic():
+                    self.import_batch(batch)
+                total += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{total} строк, {total / elapsed:.0f} строк/с')
+
+        if any(self.stats.values()):
+            catalog_changed.send(sender=self.__class__)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано {total} строк за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} строк/с). '
+            f'Изменено категорий: {self.stats["groups"]}, '
+            f'подкатегорий: {self.stats["types"]}, '
+            f'продуктов: {self.stats["products"]}; '
+            f'изображений добавлено: {self.stats["images_added"]}, '
+            f'удалено: {self.stats["images_removed"]}.'
+        ))
+        if options['thumbnails']:
+            count = render_missing_thumbnails(
+                (ProductGroup, Type, ProductImage))
+            self.stdout.write(f'Создано миниатюр: {count}')
+
+    @staticmethod
+    def open(path):
+        if path == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8',
+                        newline='', closefd=False)
+        try:
+            return open(path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(f'Не удалось открыть файл: {error}')
+
+    def read(self, file, file_format):
+        '''Читает файл построчно и приводит значения к нужным типам.'''
+        if file_format == 'csv':
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for line_number, row in enumerate(rows, start=1):
+            row = {key: value.strip() if isinstance(value, str) else value
+                   for key, value in row.items()}
+            if isinstance(row.get('images'), str):
+                row['images'] = [
+                    image.strip()
+                    for image in row['images'].split(IMAGES_SEPARATOR)
+                    if image.strip()] or None
+            for column in INT_COLUMNS:
+                if row.get(column) not in (None, ''):
+                    try:
+                        row[column] = int(row[column])
+                    except ValueError:
+                        raise CommandError(
+                            f'Строка {line_number}: {column} '
+                            'должно быть целым числом.')
+            if row.get('name') and not row.get('type'):
+                raise CommandError(
+                    f'Строка {line_number}: не указана подкатегория.')
+            yield row
+
+    @staticmethod
+    def collect(rows):
+        '''Группирует строки пакета по моделям, дубликаты объединяются.'''
+        groups, types, products, images = {}, {}, {}, {}
+        for row in rows:
+            if row.get('group'):
+                groups[row['group']] = {'slug': row.get('group_slug'),
+                                        'image': row.get('group_image')}
+            if row.get('type'):
+                types[row['type']] = {'slug': row.get('type_slug'),
+                                      'image': row.get('type_image'),
+                                      'group': row.get('group')}
+            if row.get('name'):
+                products[row['name']] = {'slug': row.get('slug'),
+                                         'type': row['type'],
+                                         'price': row.get('price'),
+                                         'in_stock': row.get('in_stock')}
+                if row.get('images') is not None:
+                    images[row['name']] = row['images']
+        return groups, types, products, images
+
+    def import_batch(self, rows):
+        groups, types, products, images = self.collect(rows)
+        self.stats['groups'] += self.sync(
+            ProductGroup, self.groups, groups, GROUP_FIELDS)
+
+        for values in types.values():
+            group = values.pop('group')
+            if group:
+                values['product_group_id'] = self.groups[group]['id']
+        self.stats['types'] += self.sync(Type, self.types, types,
+                                         TYPE_FIELDS)
+
+        for name, values in products.items():
+            type_data = self.types.get(values.pop('type'))
+            if type_data is None:
+                raise CommandError(
+                    f'Подкатегория продукта {name} не найдена.')
+            values['type_id'] = type_data['id']
+        known_products = {
+            product.pop('name'): product
+            for product in Product.objects.filter(
+                name__in=products).values('id', 'name', *PRODUCT_FIELDS)
+        }
+        update_fields = PRODUCT_FIELDS
+        if not self.update_stock:
+            update_fields = tuple(field for field in PRODUCT_FIELDS
+                                  if field != 'in_stock')
+            for name in products.keys() & known_products.keys():
+                products[name].pop('in_stock')
+        stock_names = [name for name, values in products.items()
+                       if values.get('in_stock') not in (None, '')]
+        self.stats['products'] += self.sync(
+            Product, known_products, products, PRODUCT_FIELDS,
+            update_fields)
+        if self.update_stock and stock_names:
+            # Остаток продукта с частями - сумма частей: части
+            # пересоздаются, только если остаток из файла от нее
+            # отличается.
+            for product in Product.objects.filter(
+                    name__in=stock_names, stock_shards__gt=1).annotate(
+                        shards_total=Sum('shards__in_stock')):
+                if product.in_stock != product.shards_total:
+                    set_stock_shards(product, product.stock_shards,
+                                     product.in_stock)
+
+        self.sync_images({known_products[name]['id']: product_images
+                          for name, product_images in images.items()})
+
+    @staticmethod
+    def sync(model, known, incoming, fields, update_fields=None):
+        '''
+        Создает и обновляет одним запросом объекты, которых нет в known
+        или которые отличаются от него, затем обновляет known.
+        Пустые значения не меняют существующие объекты.
+        Возвращает число записанных объектов.
+        '''
+        names = []
+        for name, values in incoming.items():
+            values = {field: value for field, value in values.items()
+                      if value not in (None, '')}
+            current = known.get(name)
+            if current is None:
+                missing = [field for field in fields if field not in values]
+                if missing:
+                    raise CommandError(
+                        f'{model._meta.verbose_name} {name}: '
+                        f'не заполнены поля {", ".join(missing)}.')
+            elif all(current[field] == value
+                     for field, value in values.items()):
+                continue
+            else:
+                values = {**current, **values}
+            incoming[name] = values
+            names.append(name)
+
+        if names:
+            Command.check_slugs(model, incoming, names)
+            model.objects.bulk_create(
+                [model(name=name,
+                       **{field: incoming[name][field] for field in fields})
+                 for name in names],
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=list(update_fields or fields),
+            )
+            for values in model.objects.filter(name__in=names).values(
+                    'id', 'name', *fields):
+                known[values.pop('name')] = values
+        return len(names)
+
+    @staticmethod
+    def check_slugs(model, incoming, names):
+        '''
+        Объекты сопоставляются по названию, поэтому слаг, занятый
+        объектом с другим названием, нарушил бы уникальность слага
+        при записи. Такие строки отклоняются до записи пакета.
+        '''
+        owners = {}
+        for name in names:
+            slug = incoming[name]['slug']
+            if slug in owners:
+                raise CommandError(
+                    f'{model._meta.verbose_name} {name}: слаг {slug} '
+                    f'уже указан для {owners[slug]}.')
+            owners[slug] = name
+        taken = model.objects.filter(slug__in=owners).exclude(
+            name__in=names).values_list('slug', 'name').first()
+        if taken is not None:
+            slug, other = taken
+            raise CommandError(
+                f'{model._meta.verbose_name} {owners[slug]}: слаг {slug} '
+                f'уже занят объектом {other}.')
+
+    def sync_images(self, images):
+        '''Приводит изображения продуктов к списку из файла.'''
+        if not images:
+            return
+        existing = {}
+        for image_id, product_id, image in ProductImage.objects.filter(
+                product_id__in=images).order_by().values_list(
+                    'id', 'product_id', 'image'):
+            existing.setdefault(product_id, {})[image] = image_id
+
+        new_images, removed_ids = [], []
+        for product_id, product_images in images.items():
+            current = existing.get(product_id, {})
+            new_images.extend(
+                ProductImage(product_id=product_id, image=image)
+                for image in dict.fromkeys(product_images)
+                if image not in current)
+            removed_ids.extend(image_id for image, image_id in current.items()
+                               if image not in product_images)
+        if new_images:
+            ProductImage.objects.bulk_create(new_images)
+        if removed_ids:
+            ProductImage.objects.filter(id__in=removed_ids).delete()
+        self.stats['images_added'] += len(new_images)
+        self.stats['images_removed'] += len(removed_ids)
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from products.models import Product
+from products.services import rebalance_stock_shards, set_stock_shards
+from store.constans import MAX_STOCK_SHARDS
+
+
+class Command(BaseCommand):
+    '''
+    Поровну перераспределяет остатки продуктов между их частями:
+    покупки списывают товар из случайной части, и со временем
+    части расходятся. Продукты обрабатываются пачками по
+    --batch-size в отдельных коротких транзакциях. С --loop команда
+    работает постоянно. С --product и --shards задает число частей
+    остатка продуктов.
+    '''
+    help = 'Перераспределение остатков между частями остатка продуктов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', action='append', default=[],
+                            help='Название продукта, можно указать '
+                                 'несколько раз.')
+        parser.add_argument('--shards', type=int,
+                            help='Новое число частей остатка продуктов '
+                                 '--product, 1 - без частей.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Число продуктов в одной транзакции.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно.')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Пауза между проходами в секундах '
+                                 'для --loop.')
+
+    def handle(self, *args, **options):
+        if options['shards'] is not None:
+            self.set_shards(options['product'], options['shards'])
+            return
+        if options['product']:
+            raise CommandError('Для --product нужно указать --shards.')
+        for name in ('batch_size', 'interval'):
+            if options[name] <= 0:
+                raise CommandError(f'--{name.replace("_", "-")} '
+                                   f'должно быть больше 0.')
+        if not options['loop']:
+            self.rebalance(options['batch_size'])
+            return
+        try:
+            while True:
+                self.rebalance(options['batch_size'])
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def set_shards(self, names, shards):
+        if not names:
+            raise CommandError('Для --shards нужно указать --product.')
+        if not 1 <= shards <= MAX_STOCK_SHARDS:
+            raise CommandError(f'--shards должно быть от 1 '
+                               f'до {MAX_STOCK_SHARDS}.')
+        products = list(Product.objects.filter(name__in=names))
+        missing = set(names) - {product.name for product in products}
+        if missing:
+            raise CommandError(
+                f'Продукты не найдены: {", ".join(sorted(missing))}.')
+        for product in products:
+            set_stock_shards(product, shards)
+            self.stdout.write(f'Остаток продукта {product.name} '
+                              f'разделен на {shards} частей.')
+
+    def rebalance(self, batch_size):
+        started = time.monotonic()
+        product_ids = list(Product.objects.filter(
+            stock_shards__gt=1).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(product_ids), batch_size):
+            rebalance_stock_shards(product_ids[start:start + batch_size])
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Остатки {len(product_ids)} продуктов перераспределены '
+            f'за {elapsed:.1f} с.')
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from products.services import release_expired_reservations
+
+
+class Command(BaseCommand):
+    '''
+    Возвращает на склад товары корзин, количество которых
+    не менялось дольше --ttl секунд. Строки удаляются пачками
+    по --batch-size в отдельных коротких транзакциях, пока
+    не останется просроченных. С --loop команда работает
+    постоянно и проверяет корзины каждые --interval секунд.
+    '''
+    help = 'Возврат на склад просроченных резервов корзин.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int,
+                            default=settings.CART_RESERVATION_TTL,
+                            help='Время жизни резерва в секундах.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Число строк корзин в одной транзакции.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно.')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Пауза между проходами в секундах '
+                                 'для --loop.')
+
+    def handle(self, *args, **options):
+        for name in ('ttl', 'batch_size', 'interval'):
+            if options[name] <= 0:
+                raise CommandError(f'--{name.replace("_", "-")} '
+                                   f'должно быть больше 0.')
+        if not options['loop']:
+            self.release(options['ttl'], options['batch_size'])
+            return
+        try:
+            while True:
+                self.release(options['ttl'], options['batch_size'])
+                # Соединение долгоживущего процесса закрывается
+                # по CONN_MAX_AGE, как после запроса.
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def release(self, ttl, batch_size):
+        '''
+        Один проход по просроченным резервам. Проход заканчивается
+        на неполной пачке: пропущенные заблокированные строки
+        освобождаются следующим проходом.
+        '''
+        started = time.monotonic()
+        total_lines = total_units = 0
+        while True:
+            expired_before = timezone.now() - timedelta(seconds=ttl)
+            lines, units = release_expired_reservations(
+                expired_before, batch_size)
+            total_lines += lines
+            total_units += units
+            if lines < batch_size:
+                break
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Возвращено на склад {total_units} единиц товара '
+            f'из {total_lines} строк корзин за {elapsed:.1f} с '
+            f'({total_units / max(elapsed, 1e-9):.0f} единиц/с).')
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.CheckConstraint(check=models.Q(('in_stock__gte', 0)), name='product_in_stock_non_negative'),
+        ),
+    ]
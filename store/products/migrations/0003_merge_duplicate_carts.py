@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:42
+
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+# Наибольшее значение SmallIntegerField количества товара в корзине.
+MAX_CART_AMOUNT = 32767
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    '''
+    Объединяет лишние корзины пользователя с самой первой.
+    Товары уже списаны со склада, поэтому остатки не меняются,
+    кроме количества сверх MAX_CART_AMOUNT: оно возвращается на склад.
+    '''
+    Cart = apps.get_model('products', 'Cart')
+    CartProduct = apps.get_model('products', 'CartProduct')
+    Product = apps.get_model('products', 'Product')
+    duplicated = Cart.objects.values('user_id').annotate(
+        carts=Count('id'), kept_id=Min('id')).filter(carts__gt=1)
+    for row in duplicated:
+        kept_id = row['kept_id']
+        extra_carts = Cart.objects.filter(
+            user_id=row['user_id']).exclude(pk=kept_id)
+        kept_lines = {line.product_id: line for line in
+                      CartProduct.objects.filter(cart_id=kept_id)}
+        for line in CartProduct.objects.filter(cart__in=extra_carts):
+            kept_line = kept_lines.get(line.product_id)
+            if kept_line is None:
+                line.cart_id = kept_id
+                line.save(update_fields=['cart'])
+                kept_lines[line.product_id] = line
+            else:
+                total = kept_line.amount + line.amount
+                kept_line.amount = min(total, MAX_CART_AMOUNT)
+                kept_line.save(update_fields=['amount'])
+                if total > MAX_CART_AMOUNT:
+                    Product.objects.filter(pk=line.product_id).update(
+                        in_stock=F('in_stock') + total - MAX_CART_AMOUNT)
+                line.delete()
+        extra_carts.delete()
+
+
+class Migration(migrations.Migration):
+    '''
+    Отдельная миграция: изменения строк в PostgreSQL оставляют
+    отложенные проверки внешних ключей, и ALTER TABLE в той же
+    транзакции завершается ошибкой pending trigger events.
+    '''
+
+    dependencies = [
+        ('products', '0002_product_in_stock_non_negative'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts,
+                             migrations.RunPython.noop),
+    ]
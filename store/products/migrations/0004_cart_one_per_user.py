@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0003_merge_duplicate_carts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_cart_one_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productgroup',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='renditions/product_group/', verbose_name='Миниатюра'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='renditions/product/', verbose_name='Миниатюра'),
+        ),
+        migrations.AddField(
+            model_name='type',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='renditions/type/', verbose_name='Миниатюра'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-18 17:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cart',
+            options={'ordering': ('user_id',), 'verbose_name': 'Корзина пользователя', 'verbose_name_plural': 'Корзины пользователей'},
+        ),
+        migrations.AlterModelOptions(
+            name='cartproduct',
+            options={'ordering': ('cart_id', 'product_id'), 'verbose_name': 'Продукт в корзине', 'verbose_name_plural': 'Продукты в корзине'},
+        ),
+        migrations.AlterModelOptions(
+            name='productimage',
+            options={'ordering': ('product_id', 'id'), 'verbose_name': 'Изображение продукта', 'verbose_name_plural': 'Изображения продуктов'},
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'id'], include=('image', 'thumbnail'), name='productimage_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='type',
+            index=models.Index(fields=['product_group', 'name'], name='type_group_name_idx'),
+        ),
+        migrations.AlterField(
+            model_name='cartproduct',
+            name='cart',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='products.cart', verbose_name='Корзина'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='images', to='products.product', verbose_name='Продукт'),
+        ),
+        migrations.AlterField(
+            model_name='type',
+            name='product_group',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='products.productgroup', verbose_name='Продуктовая категория'),
+        ),
+    ]
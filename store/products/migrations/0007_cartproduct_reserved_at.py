@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_index_audit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartproduct',
+            name='reserved_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Зарезервировано'),
+        ),
+    ]
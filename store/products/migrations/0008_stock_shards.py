@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 17:18
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_cartproduct_reserved_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Остаток популярного продукта делится на части, чтобы одновременные покупки не ждали друг друга.', validators=[django.core.validators.MinValueValidator(1, 'Минимум 1'), django.core.validators.MaxValueValidator(64, 'Максимум 64')], verbose_name='Число частей остатка'),
+        ),
+        migrations.CreateModel(
+            name='ProductStockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField(verbose_name='Номер части')),
+                ('in_stock', models.SmallIntegerField(validators=[django.core.validators.MinValueValidator(0, 'Минимальное количество 0')], verbose_name='Остаток')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='products.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Часть остатка продукта',
+                'verbose_name_plural': 'Части остатков продуктов',
+                'ordering': ('product_id', 'number'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productstockshard',
+            constraint=models.UniqueConstraint(fields=('product', 'number'), name='unique_stock_shard'),
+        ),
+        migrations.AddConstraint(
+            model_name='productstockshard',
+            constraint=models.CheckConstraint(check=models.Q(('in_stock__gte', 0)), name='stock_shard_in_stock_non_negative'),
+        ),
+    ]
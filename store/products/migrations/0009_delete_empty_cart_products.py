@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 17:49
+
+from django.db import migrations
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+
+def delete_empty_cart_products(apps, schema_editor):
+    '''
+    Удаляет из корзин строки с количеством меньше 1: их нельзя
+    было создать, пока CartProduct.save вызывал full_clean.
+    Строка с отрицательным количеством добавила товар на склад,
+    при удалении он списывается обратно.
+    '''
+    CartProduct = apps.get_model('products', 'CartProduct')
+    Product = apps.get_model('products', 'Product')
+    lines = CartProduct.objects.filter(amount__lt=1)
+    for product_id, amount in lines.filter(amount__lt=0).values_list(
+            'product_id', 'amount'):
+        Product.objects.filter(pk=product_id).update(
+            in_stock=Greatest(F('in_stock') + amount, Value(0)))
+    lines.delete()
+
+
+class Migration(migrations.Migration):
+    '''
+    Отдельная миграция по той же причине, что и
+    0003_merge_duplicate_carts: изменения строк и ALTER TABLE
+    в одной транзакции PostgreSQL завершаются ошибкой.
+    '''
+
+    dependencies = [
+        ('products', '0008_stock_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_empty_cart_products,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_delete_empty_cart_products'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.CheckConstraint(check=models.Q(('amount__gte', 1)), name='cart_product_amount_positive'),
+        ),
+    ]
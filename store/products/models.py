@@ -1,9 +1,14 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import (Case, F, OuterRef, Prefetch, Subquery, Sum,
+                              When)
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
 
-from store.constans import MAX_LENGTH, MIN_NUM, MIN_NUM_IN_STOCK
+from store.constans import (MAX_LENGTH, MAX_STOCK_SHARDS, MIN_NUM,
+                            MIN_NUM_IN_STOCK)
 
 User = get_user_model()
 
@@ -18,6 +23,9 @@ class ProductGroup(models.Model):
                             unique=True)
     image = models.ImageField('Изображение',
                               upload_to='product_group/')
+    thumbnail = models.ImageField('Миниатюра',
+                                  upload_to='renditions/product_group/',
+                                  blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Категория продуктов'
@@ -38,21 +46,51 @@ class Type(models.Model):
                             unique=True)
     image = models.ImageField('Изображение',
                               upload_to='type/')
+    thumbnail = models.ImageField('Миниатюра',
+                                  upload_to='renditions/type/',
+                                  blank=True, editable=False)
+    # Индекс по категории - первая колонка составного индекса.
     product_group = models.ForeignKey(ProductGroup,
                                       on_delete=models.CASCADE,
+                                      db_index=False,
                                       verbose_name='Продуктовая категория')
 
     class Meta:
         verbose_name = 'Подкатегория'
         verbose_name_plural = 'Подкатегории'
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['product_group', 'name'],
+                         name='type_group_name_idx')]
 
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+
+    def with_stock(self):
+        '''
+        Остаток продуктов в том же запросе: для продукта, остаток
+        которого разделен на части, - сумма частей.
+        '''
+        shards_in_stock = ProductStockShard.objects.filter(
+            product=OuterRef('pk')).order_by().values('product').annotate(
+                total=Sum('in_stock')).values('total')
+        return self.annotate(total_in_stock=Case(
+            When(stock_shards__gt=1,
+                 then=Coalesce(Subquery(shards_in_stock), 0)),
+            default=F('in_stock'),
+        ))
+
+
 class Product(models.Model):
-    '''Модель для определения продукта.'''
+    '''
+    Модель для определения продукта.
+    Остаток продукта с stock_shards больше 1 хранится в частях
+    ProductStockShard, а in_stock - сумма частей на момент
+    последнего распределения остатка.
+    '''
     name = models.CharField('Название', max_length=MAX_LENGTH,
                             unique=True, blank=False)
     slug = models.SlugField('Слаг', max_length=MAX_LENGTH,
@@ -72,57 +110,166 @@ class Product(models.Model):
                 MIN_NUM_IN_STOCK,
                 f'Минимальное количество {MIN_NUM_IN_STOCK}'),
         ],)
+    stock_shards = models.PositiveSmallIntegerField(
+        'Число частей остатка', default=MIN_NUM,
+        help_text='Остаток популярного продукта делится на части, '
+                  'чтобы одновременные покупки не ждали друг друга.',
+        validators=[
+            MinValueValidator(MIN_NUM, f'Минимум {MIN_NUM}'),
+            MaxValueValidator(MAX_STOCK_SHARDS,
+                              f'Максимум {MAX_STOCK_SHARDS}'),
+        ],)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ('name',)
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(in_stock__gte=MIN_NUM_IN_STOCK),
+                name='product_in_stock_non_negative')]
 
     def __str__(self):
         return f'{self.name}'
 
+    def get_total_in_stock(self):
+        '''Остаток продукта с учетом частей остатка.'''
+        if self.stock_shards == 1:
+            return self.in_stock
+        if hasattr(self, 'total_in_stock'):
+            return self.total_in_stock
+        return self.shards.aggregate(
+            total=Coalesce(Sum('in_stock'), 0))['total']
+
     @property
     def product_group(self):
         '''Возвращает категорию продукта через подкатегорию.'''
         return self.type.product_group
 
-    def decrease_stock(self, amount):
-        '''Уменьшить остаток на складе.'''
-        self.in_stock -= amount
-        self.save()
 
-    def increase_stock(self, amount):
-        '''Увеличить остаток на складе.'''
-        self.in_stock += amount
-        self.save()
+class ProductStockShard(models.Model):
+    '''
+    Модель для части остатка продукта. Покупки продукта с несколькими
+    частями остатка меняют разные строки и не ждут друг друга.
+    '''
+    # Индекс по продукту - первая колонка ограничения уникальности.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='shards', db_index=False,
+                                verbose_name='Продукт')
+    number = models.PositiveSmallIntegerField('Номер части')
+    in_stock = models.SmallIntegerField(
+        'Остаток',
+        validators=[
+            MinValueValidator(
+                MIN_NUM_IN_STOCK,
+                f'Минимальное количество {MIN_NUM_IN_STOCK}'),
+        ],)
+
+    class Meta:
+        verbose_name = 'Часть остатка продукта'
+        verbose_name_plural = 'Части остатков продуктов'
+        ordering = ('product_id', 'number')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'number'],
+                name='unique_stock_shard'),
+            models.CheckConstraint(
+                check=models.Q(in_stock__gte=MIN_NUM_IN_STOCK),
+                name='stock_shard_in_stock_non_negative')]
+
+    def __str__(self):
+        return f'{self.product} - часть {self.number}'
 
 
 class ProductImage(models.Model):
     '''Модель для изображений продукта.'''
     product = models.ForeignKey('Product', on_delete=models.CASCADE,
-                                related_name='images', verbose_name='Продукт')
+                                related_name='images', db_index=False,
+                                verbose_name='Продукт')
     image = models.ImageField('Изображение', upload_to='product/')
+    thumbnail = models.ImageField('Миниатюра',
+                                  upload_to='renditions/product/',
+                                  blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Изображение продукта'
         verbose_name_plural = 'Изображения продуктов'
-        ordering = ('product',)
+        ordering = ('product_id', 'id')
+        # Изображения продуктов читаются из индекса без обращения
+        # к таблице (INCLUDE поддерживается только в PostgreSQL).
+        indexes = [
+            models.Index(fields=['product', 'id'],
+                         include=['image', 'thumbnail'],
+                         name='productimage_product_idx')]
 
     def __str__(self):
         return f'{self.product.name} - {self.image}'
 
 
+class GroupConcat(models.Aggregate):
+    '''
+    Значения группы строк через разделитель: STRING_AGG в PostgreSQL,
+    GROUP_CONCAT в SQLite.
+    '''
+    function = 'STRING_AGG'
+    output_field = models.CharField()
+
+    def __init__(self, expression, delimiter, **extra):
+        super().__init__(expression, models.Value(delimiter), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='GROUP_CONCAT',
+                              **extra_context)
+
+
+class CartQuerySet(models.QuerySet):
+
+    def annotate_totals(self, **annotations):
+        return self.annotate(
+            total_price=Coalesce(
+                Sum(Cast('cartproduct__amount', models.IntegerField())
+                    * F('cartproduct__product__price')),
+                0),
+            total_amount=Coalesce(
+                Sum(Cast('cartproduct__amount', models.IntegerField())),
+                0),
+            **annotations,
+        )
+
+    def with_totals(self):
+        '''
+        Считает общую стоимость и количество товаров в корзине в БД
+        и загружает товары корзины вместе с продуктами одним запросом.
+        '''
+        return self.annotate_totals().prefetch_related(
+            Prefetch('cartproduct_set',
+                     queryset=CartProduct.objects.select_related('product'))
+        )
+
+    def with_summary(self):
+        '''
+        Итоги корзины и названия ее товаров через запятую
+        в том же запросе, без загрузки товаров.
+        '''
+        return self.annotate_totals(product_names=GroupConcat(
+            'cartproduct__product__name', ', '))
+
+
 class Cart(models.Model):
     '''Модель для определения продуктовой корзины.'''
-    user = models.ForeignKey(User, on_delete=models.CASCADE,
-                             verbose_name='Пользователь')
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                verbose_name='Пользователь')
     products = models.ManyToManyField(Product, through='CartProduct',
                                       verbose_name='Содержание корзины')
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Корзина пользователя'
         verbose_name_plural = 'Корзины пользователей'
-        ordering = ('user',)
+        ordering = ('user_id',)
 
     def __str__(self):
         return f'Содержание корзины пользователя {self.user}.'
@@ -130,8 +277,9 @@ class Cart(models.Model):
 
 class CartProduct(models.Model):
     '''Модель для добавления продуктов в корзину.'''
+    # Индекс по корзине - первая колонка ограничения уникальности.
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE,
-                             verbose_name='Корзина')
+                             db_index=False, verbose_name='Корзина')
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
                                 verbose_name='Содержание корзины')
     amount = models.SmallIntegerField(
@@ -140,41 +288,42 @@ class CartProduct(models.Model):
             MinValueValidator(
                 MIN_NUM, f'Минимальное количество {MIN_NUM}'),
         ],)
+    # Время последнего изменения количества. Просроченные резервы
+    # возвращает на склад команда release_expired_reservations.
+    reserved_at = models.DateTimeField('Зарезервировано',
+                                       default=timezone.now,
+                                       db_index=True)
 
     class Meta:
         verbose_name = 'Продукт в корзине'
         verbose_name_plural = 'Продукты в корзине'
-        ordering = ('cart',)
+        ordering = ('cart_id', 'product_id')
         constraints = [
             models.UniqueConstraint(
                 fields=['cart', 'product'],
-                name='unique_product_in_cart')]
+                name='unique_product_in_cart'),
+            models.CheckConstraint(
+                check=models.Q(amount__gte=MIN_NUM),
+                name='cart_product_amount_positive')]
 
     def __str__(self):
         return f'В корзину добавили {self.amount} {self.product}.'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''Запоминает количество, уже списанное со склада.'''
+        instance = super().from_db(db, field_names, values)
+        instance._reserved_amount = instance.__dict__.get('amount', 0)
+        instance._reserved_product_id = instance.__dict__.get('product_id')
+        return instance
+
     def clean(self):
         '''Проверка наличия достаточного количества товара на складе.'''
-        if self.amount > self.product.in_stock:
+        reserved = 0
+        if getattr(self, '_reserved_product_id', None) == self.product_id:
+            reserved = self._reserved_amount
+        in_stock = self.product.get_total_in_stock()
+        if self.amount - reserved > in_stock:
             raise ValidationError(
                 f'Недостаточно товара {self.product.name} на складе. '
-                f'Доступно: {self.product.in_stock}.')
-
-    def save(self, *args, **kwargs):
-        '''Переопределение сохранения для изменения остатка.'''
-        self.full_clean()
-        if self.pk is None:
-            self.product.decrease_stock(self.amount)
-        else:
-            original = CartProduct.objects.get(pk=self.pk)
-            diff = self.amount - original.amount
-            if diff > 0:
-                self.product.decrease_stock(diff)
-            elif diff < 0:
-                self.product.increase_stock(-diff)
-        super().save(*args, **kwargs)
-
-    def delete(self, *args, **kwargs):
-        '''Возвращаем остаток при удалении из корзины.'''
-        self.product.increase_stock(self.amount)
-        super().delete(*args, **kwargs)
+                f'Доступно: {in_stock}.')
@@ -1,9 +1,43 @@
+import json
 from http import HTTPStatus
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
 import pytest
-from conftest import AMOUNT
+from asgiref.sync import async_to_sync
+from conftest import AMOUNT, IMAGE, IN_STOCK
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from prometheus_client import REGISTRY
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
 
-from products.models import CartProduct
+from api.authentication import (CachedTokenAuthentication,
+                                get_token_cache_key)
+from api.serializers import Base64ImageField
+from api.views import get_catalog_validators
+from products.benchmark import (Workload, create_dataset, get_tokens,
+                                run_requests, summarize)
+from products.models import (Cart, CartProduct, Product, ProductImage,
+                             ProductStockShard)
+from products.query_plans import hot_queries, plan_problems
+from products.renditions import render_thumbnail
+from products.scale_data import ScaleData
+from products.services import (add_to_cart, rebalance_stock_shards,
+                               set_stock_shards)
+from store.constans import MAX_CART_AMOUNT
+from store.db_pool.pool import ConnectionPool
+from store.paginator import EstimatedCountPaginator
+from users.models import User
 
 
 def test_add_product_to_cart(author_client, product, cart):
@@ -32,6 +66,18 @@ def test_clear_cart(author_client, product, cart):
     response = author_client.delete('/api/cart/clear-cart/')
 
     assert response.status_code == HTTPStatus.NO_CONTENT
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+
+
+def test_deleting_user_returns_cart_to_stock(author, product, cart):
+    '''При удалении пользователя товары из корзины возвращаются на склад.'''
+    add_to_cart(cart, product, AMOUNT)
+    author.delete()
+
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+    assert not Cart.objects.exists()
 
 
 @pytest.mark.django_db
@@ -68,3 +114,693 @@ def test_anonymous_user_can_read_product(
     '''Аноним может просматривать продукты.'''
     response = client.get('/api/products/')
     assert response.status_code == HTTPStatus.OK
+
+
+def test_product_list_marks_products_in_cart(author_client, cart_product,
+                                             django_assert_max_num_queries):
+    '''Товары из корзины отмечаются без запроса на каждый продукт.'''
+    with django_assert_max_num_queries(6):
+        response = author_client.get('/api/products/')
+    assert response.status_code == HTTPStatus.OK
+
+    results = response.json()['results']
+    assert results[0]['is_in_shopping_cart'] is True
+
+
+@pytest.mark.django_db
+def test_product_group_cache_is_invalidated_on_change(client, product_group,
+                                                      type):
+    '''Изменение категории сразу видно в закэшированном списке.'''
+    client.get('/api/groups/')
+    product_group.name = 'Новое название'
+    product_group.save()
+
+    response = client.get('/api/groups/')
+    assert response.json()['results'][0]['name'] == 'Новое название'
+
+
+@pytest.mark.django_db
+def test_product_cursor_pagination(client, product):
+    '''Пагинация по курсору не возвращает общее количество товаров.'''
+    response = client.get('/api/products/?pagination=cursor&page_size=10')
+    assert response.status_code == HTTPStatus.OK
+
+    response = response.json()
+    assert 'count' not in response
+    assert response['results'][0]['name'] == product.name
+
+
+@pytest.mark.django_db
+def test_unchanged_catalog_returns_not_modified(client, product):
+    '''Повторный запрос с If-None-Match получает 304.'''
+    response = client.get('/api/products/')
+    etag = response['ETag']
+
+    response = client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    product.price += 1
+    product.save()
+    response = client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_last_modified_is_sent_after_its_second(monkeypatch):
+    '''
+    Last-Modified не отдается, пока не закончилась секунда
+    последнего изменения: изменение в ту же секунду не дает 304.
+    '''
+    version = 5_200_000_000
+    monkeypatch.setattr('api.views.time.time', lambda: 5.5)
+    assert get_catalog_validators('/', 'json', [version])[1] is None
+    monkeypatch.setattr('api.views.time.time', lambda: 6.5)
+    assert get_catalog_validators('/', 'json', [version])[1] == 6
+    assert get_catalog_validators('/', 'json', [version], ['user'])[1] is None
+
+
+@pytest.mark.django_db
+def test_catalog_tree_is_served_from_snapshot(
+    client, product, django_assert_num_queries
+):
+    '''Дерево каталога строится один раз и отдается без запросов к БД.'''
+    response = client.get('/api/catalog/?products=true')
+    assert response.status_code == HTTPStatus.OK
+    group = response.json()[0]
+    assert group['types'][0]['products'][0]['name'] == product.name
+
+    with django_assert_num_queries(0):
+        response = client.get('/api/catalog/')
+    assert 'products' not in response.json()[0]['types'][0]
+
+
+def test_add_product_to_cart_reserves_stock_once(author_client, product, cart):
+    '''Добавление в корзину списывает товар со склада один раз.'''
+    data = {'product': product.name, 'amount': AMOUNT}
+    author_client.post('/api/cart/', data=data)
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK - AMOUNT
+
+    data['amount'] = IN_STOCK
+    response = author_client.post('/api/cart/', data=data)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK - AMOUNT
+
+
+def test_cart_batch_operations(author_client, product, cart):
+    '''Пакетное изменение корзины применяет операции по порядку.'''
+    data = {'operations': [
+        {'op': 'add', 'product': product.name, 'amount': AMOUNT},
+        {'op': 'set', 'product': product.name, 'amount': IN_STOCK},
+    ]}
+    response = author_client.post('/api/cart/batch/', data=data,
+                                  format='json')
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['total_amount'] == IN_STOCK
+    product.refresh_from_db()
+    assert product.in_stock == 0
+
+    data = {'operations': [{'op': 'remove', 'product': product.name}]}
+    author_client.post('/api/cart/batch/', data=data, format='json')
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+    assert not CartProduct.objects.filter(cart=cart).exists()
+
+
+def test_cart_totals_are_computed_in_database(
+    author_client, cart_product, django_assert_max_num_queries
+):
+    '''Итоги корзины считаются без запросов на каждый товар.'''
+    with django_assert_max_num_queries(3):
+        response = author_client.get('/api/cart/')
+    assert response.status_code == HTTPStatus.OK
+
+    cart = response.json()[0]
+    assert cart['total_amount'] == AMOUNT
+    assert cart['total_price'] == AMOUNT * cart_product.product.price
+
+
+@pytest.mark.django_db(transaction=True)
+def test_migration_merges_duplicate_carts():
+    '''
+    Тестируем миграцию корзин: лишние корзины пользователя
+    объединяются с первой, количества одного товара складываются,
+    а количество сверх MAX_CART_AMOUNT возвращается на склад.
+    '''
+    before = [('products', '0002_product_in_stock_non_negative')]
+    after = [('products', '0004_cart_one_per_user')]
+    executor = MigrationExecutor(connection)
+    executor.migrate(before)
+    apps = executor.loader.project_state(before).apps
+    user = apps.get_model('users', 'User').objects.create(
+        username='user', email='user@mail.com', password='!')
+    group = apps.get_model('products', 'ProductGroup').objects.create(
+        name='group', slug='group', image=IMAGE)
+    product_type = apps.get_model('products', 'Type').objects.create(
+        name='type', slug='type', image=IMAGE, product_group=group)
+    Product = apps.get_model('products', 'Product')
+    products = [Product.objects.create(name=name, slug=name, price=1,
+                                       in_stock=IN_STOCK, type=product_type)
+                for name in ('first', 'second')]
+    Cart = apps.get_model('products', 'Cart')
+    CartProduct = apps.get_model('products', 'CartProduct')
+    carts = [Cart.objects.create(user=user) for _ in range(3)]
+    for cart in carts:
+        CartProduct.objects.create(cart=cart, product=products[0],
+                                   amount=AMOUNT)
+    for cart in carts[1:]:
+        CartProduct.objects.create(cart=cart, product=products[1],
+                                   amount=MAX_CART_AMOUNT - 1)
+
+    executor.loader.build_graph()
+    executor.migrate(after)
+    apps = executor.loader.project_state(after).apps
+    Cart = apps.get_model('products', 'Cart')
+    CartProduct = apps.get_model('products', 'CartProduct')
+    assert list(Cart.objects.values_list('pk', flat=True)) == [carts[0].pk]
+    assert sorted(CartProduct.objects.values_list(
+        'product__name', 'amount')) == [('first', 3 * AMOUNT),
+                                        ('second', MAX_CART_AMOUNT)]
+    assert apps.get_model('products', 'Product').objects.get(
+        name='second').in_stock == IN_STOCK + MAX_CART_AMOUNT - 2
+
+    executor.loader.build_graph()
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+def test_cart_amount_is_limited(author_client, product, cart):
+    '''Слишком большое количество товара - ошибка 400, а не 500.'''
+    Product.objects.filter(pk=product.pk).update(in_stock=MAX_CART_AMOUNT)
+    too_many = MAX_CART_AMOUNT + 1
+    response = author_client.post(
+        '/api/cart/', data={'product': product.name, 'amount': too_many})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = author_client.post(
+        '/api/cart/batch/', format='json',
+        data={'operations': [{'op': 'add', 'product': product.name,
+                              'amount': MAX_CART_AMOUNT}] * 2})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    add_to_cart(cart, product, AMOUNT)
+    Product.objects.filter(pk=product.pk).update(in_stock=MAX_CART_AMOUNT)
+    response = author_client.post(
+        '/api/cart/',
+        data={'product': product.name, 'amount': MAX_CART_AMOUNT})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = author_client.patch(
+        '/api/cart/update-product/', format='json',
+        data={'product': product.name, 'amount': too_many})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    product.refresh_from_db()
+    assert product.in_stock == MAX_CART_AMOUNT
+
+
+def test_cart_amount_must_be_positive(author_client, product, cart):
+    '''Нулевое и отрицательное количество товара - ошибка 400.'''
+    for amount in (0, -1):
+        response = author_client.post(
+            '/api/cart/', data={'product': product.name, 'amount': amount})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        with pytest.raises(DjangoValidationError):
+            add_to_cart(cart, product, amount)
+    assert not CartProduct.objects.exists()
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+    with pytest.raises(IntegrityError):
+        CartProduct.objects.create(cart=cart, product=product, amount=0)
+
+
+def test_user_has_single_cart(author_client, author, product):
+    '''У пользователя создается только одна корзина.'''
+    data = {'product': product.name, 'amount': AMOUNT}
+    author_client.post('/api/cart/', data=data)
+    author_client.post('/api/cart/', data=data)
+
+    assert Cart.objects.filter(user=author).count() == 1
+
+
+@pytest.mark.django_db
+def test_image_upload_limits_and_thumbnail(settings, tmp_path, product):
+    '''
+    Тестируем ограничения загрузки изображений в base64
+    и создание миниатюры в формате WebP.
+    '''
+    settings.MEDIA_ROOT = tmp_path
+    field = Base64ImageField()
+
+    settings.IMAGE_UPLOAD_MAX_SIZE = 100
+    with pytest.raises(ValidationError):
+        field.to_internal_value(IMAGE)
+    settings.IMAGE_UPLOAD_MAX_SIZE = 1024 * 1024
+    settings.IMAGE_UPLOAD_MAX_PIXELS = 4
+    with pytest.raises(ValidationError):
+        field.to_internal_value(IMAGE)
+    settings.IMAGE_UPLOAD_MAX_PIXELS = 9
+
+    product_image = ProductImage.objects.create(
+        product=product, image=field.to_internal_value(IMAGE))
+    assert not product_image.thumbnail
+    render_thumbnail(ProductImage, product_image.pk)
+
+    product_image.refresh_from_db()
+    assert product_image.thumbnail.name.startswith('renditions/product/')
+    with Image.open(product_image.thumbnail.path) as thumbnail:
+        assert thumbnail.format == 'WEBP'
+
+
+def test_json_body_size_is_limited(author_client, product, cart, settings):
+    '''Тело JSON больше DATA_UPLOAD_MAX_MEMORY_SIZE - ошибка 413.'''
+    settings.DATA_UPLOAD_MAX_MEMORY_SIZE = 100
+    data = {'operations': [{'op': 'add', 'product': product.name,
+                            'amount': AMOUNT}]}
+    response = author_client.post('/api/cart/batch/', data=data,
+                                  format='json')
+    assert response.status_code == HTTPStatus.OK
+    response = author_client.post('/api/cart/batch/', format='json',
+                                  data={**data, 'padding': 'x' * 100})
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+@pytest.mark.django_db
+def test_import_catalog_is_idempotent(tmp_path, django_assert_num_queries):
+    '''
+    Тестируем импорт каталога: повторный импорт того же файла
+    только читает данные и не меняет остатки.
+    '''
+    path = tmp_path / 'catalog.jsonl'
+    path.write_text(
+        '{"group": "Молочные продукты", "group_slug": "dairy", '
+        '"group_image": "product_group/dairy.jpg", "type": "Молоко", '
+        '"type_slug": "milk", "type_image": "type/milk.jpg", '
+        '"name": "Молоко 2%", "slug": "milk1", "price": 100, '
+        '"in_stock": 50, "images": ["product/milk1.jpg"]}\n',
+        encoding='utf-8')
+    call_command('import_catalog', str(path))
+    product = Product.objects.get(name='Молоко 2%')
+    assert product.type.product_group.slug == 'dairy'
+    assert product.images.count() == 1
+
+    Product.objects.filter(pk=product.pk).update(in_stock=IN_STOCK)
+    with django_assert_num_queries(6):
+        call_command('import_catalog', str(path))
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+
+    set_stock_shards(product, 2, 50)
+    shard_ids = set(product.shards.values_list('pk', flat=True))
+    call_command('import_catalog', str(path), update_stock=True)
+    assert set(product.shards.values_list('pk', flat=True)) == shard_ids
+
+    path.write_text(path.read_text(encoding='utf-8').replace('50', '60'),
+                    encoding='utf-8')
+    call_command('import_catalog', str(path), update_stock=True)
+    assert sorted(product.shards.values_list('in_stock', flat=True)) == [
+        30, 30]
+
+
+@pytest.mark.django_db
+def test_import_catalog_rejects_taken_slug(tmp_path):
+    '''Новый продукт со слагом другого продукта - ошибка строки.'''
+    path = tmp_path / 'catalog.jsonl'
+    row = ('{"group": "Молочные продукты", "group_slug": "dairy", '
+           '"group_image": "product_group/dairy.jpg", "type": "Молоко", '
+           '"type_slug": "milk", "type_image": "type/milk.jpg", '
+           '"name": "%s", "slug": "milk1", "price": 100, '
+           '"in_stock": 50}\n')
+    path.write_text(row % 'Молоко 2%', encoding='utf-8')
+    call_command('import_catalog', str(path))
+
+    path.write_text(row % 'Молоко 3%', encoding='utf-8')
+    with pytest.raises(CommandError, match='Молоко 3%: слаг milk1 уже '
+                                           'занят объектом Молоко 2%'):
+        call_command('import_catalog', str(path))
+    path.write_text(row % 'Молоко 3%' + row % 'Молоко 4%',
+                    encoding='utf-8')
+    with pytest.raises(CommandError, match='слаг milk1 уже указан'):
+        call_command('import_catalog', str(path))
+    assert list(Product.objects.values_list('name', flat=True)) == [
+        'Молоко 2%']
+
+
+def test_catalog_export_streams_products(author_client, author,
+                                         product_images):
+    '''Тестируем потоковую выгрузку каталога для админа.'''
+    url = '/api/catalog/export/'
+    assert author_client.get(url).status_code == HTTPStatus.FORBIDDEN
+
+    author.is_superuser = True
+    author.save()
+    response = author_client.get(url)
+    assert response.status_code == HTTPStatus.OK
+    assert response.streaming
+    rows = [json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()]
+    assert len(rows) == 1
+    assert len(rows[0]['images']) == len(product_images)
+
+    response = author_client.get(url, {'output': 'csv'})
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    assert lines[0].startswith('group,group_slug')
+    assert len(lines) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bootstrap_skips_unchanged_steps(tmp_path, settings, monkeypatch):
+    '''Тестируем, что повторный запуск bootstrap пропускает все шаги.'''
+    monkeypatch.setenv('USERNAME_ADMIN', 'admin')
+    settings.BOOTSTRAP_STATE_FILE = str(tmp_path / 'state.json')
+    settings.STATIC_ROOT = str(tmp_path / 'static')
+    call_command('bootstrap', stdout=StringIO())
+    assert Product.objects.exists()
+
+    output = StringIO()
+    call_command('bootstrap', stdout=output)
+    assert output.getvalue().count('пропущено') == 4
+
+
+def test_async_catalog_matches_sync(author_client, client, cart_product,
+                                    product_images):
+    '''Тестируем, что асинхронное чтение каталога совпадает с синхронным.'''
+    for url in ('/api/products/', f'/api/products/{cart_product.product.pk}/',
+                '/api/groups/', '/api/types/',
+                '/api/products/?pagination=cursor&page_size=1',
+                '/api/products/?page=5', '/api/products/0/'):
+        response = author_client.get(url.replace('/api/', '/api/async/'))
+        expected = author_client.get(url)
+        assert response.status_code == expected.status_code
+        assert response.json() == expected.json()
+
+    response = client.get('/api/async/products/',
+                          HTTP_AUTHORIZATION='Token invalid')
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_connection_pool_is_bounded_and_reuses_connections():
+    '''Тестируем ограничение размера пула и повторную выдачу соединений.'''
+    def connect():
+        return SimpleNamespace(
+            closed=0, close=lambda: None,
+            info=SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE))
+
+    pool = ConnectionPool('test', max_size=1, timeout=0.01,
+                          max_lifetime=60, check_idle=60)
+    connection, created = pool.checkout(connect)
+    with pytest.raises(OperationalError):
+        pool.checkout(connect)
+
+    pool.release(connection, created)
+    assert pool.checkout(connect)[0] is connection
+
+
+def test_token_authentication_is_cached(author_client, author, cart,
+                                        django_assert_num_queries):
+    '''
+    Тестируем кэширование токена: повторная проверка не обращается
+    к базе данных, хэш пароля не попадает в кэш, а блокировка,
+    смена пароля и выход пользователя действуют сразу.
+    '''
+    key = Token.objects.get(user=author).key
+    authentication = CachedTokenAuthentication()
+    authentication.authenticate_credentials(key)
+    assert author.password not in cache.get(get_token_cache_key(key)).values()
+    with django_assert_num_queries(0):
+        user, token = authentication.authenticate_credentials(key)
+    assert (user.pk, user.username, token.key) == (author.pk,
+                                                   author.username, key)
+
+    author.is_active = False
+    author.save()
+    response = author_client.get('/api/cart/')
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    response = author_client.get('/api/async/products/')
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+    author.is_active = True
+    author.save()
+    assert author_client.get('/api/cart/').status_code == HTTPStatus.OK
+    author.set_password('new-password')
+    author.save()
+    assert cache.get(get_token_cache_key(key)) is None
+
+    Token.objects.filter(key=key).delete()
+    response = author_client.get('/api/cart/')
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_query_metrics_are_recorded_per_view(client, product, settings,
+                                             caplog):
+    '''Тестируем метрики SQL-запросов по представлениям и лог бюджета.'''
+    labels = {'view': 'product-list', 'action': 'list'}
+    before = REGISTRY.get_sample_value('django_view_db_queries_count',
+                                       labels) or 0
+    settings.QUERY_COUNT_BUDGET = 0
+    client.get('/api/products/')
+
+    assert REGISTRY.get_sample_value('django_view_db_queries_count',
+                                     labels) == before + 1
+    assert 'product-list list' in caplog.text
+    assert 'SELECT' in caplog.text
+
+
+@pytest.mark.django_db
+def test_query_metrics_are_recorded_under_asgi(async_client, product):
+    '''
+    Тестируем метрики под ASGI: запросы асинхронных представлений
+    и синхронных представлений DRF в потоках тоже учитываются.
+    '''
+    async def get(url):
+        return await async_client.get(url)
+
+    for view, action, url in (('async-product-list', 'get',
+                               '/api/async/products/'),
+                              ('product-list', 'list', '/api/products/')):
+        labels = {'view': view, 'action': action}
+        count, total = (REGISTRY.get_sample_value(
+            f'django_view_db_queries_{name}', labels) or 0
+            for name in ('count', 'sum'))
+        response = async_to_sync(get)(url)
+        assert response.status_code == HTTPStatus.OK
+        assert REGISTRY.get_sample_value('django_view_db_queries_count',
+                                         labels) == count + 1
+        assert REGISTRY.get_sample_value('django_view_db_queries_sum',
+                                         labels) > total
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_workload_is_reproducible():
+    '''
+    Тестируем бенчмарк: сценарий с тем же seed дает те же запросы,
+    и все они выполняются без ошибок.
+    '''
+    create_dataset(products=30, users=2, seed=1)
+    requests = Workload('mixed', seed=1).generate(users=2, count=40)
+    assert Workload('mixed', seed=1).generate(users=2, count=40) == requests
+
+    samples = run_requests(requests, get_tokens(seed=1))
+    result = summarize(samples, duration=1)
+    assert result['total']['requests'] == 40
+    assert result['total']['errors'] == 0
+    assert 'GET product-list' in result['endpoints']
+
+
+@pytest.mark.django_db
+def test_generate_scale_data():
+    '''
+    Тестируем генерацию данных: все таблицы заполняются,
+    данные зависят только от seed, повтор seed запрещен.
+    '''
+    options = {'groups': 2, 'types': 4, 'products': 20, 'images': 2,
+               'users': 5, 'cart_products': 3, 'batch_size': 7,
+               'stdout': StringIO()}
+    call_command('generate_scale_data', seed=1, **options)
+    call_command('generate_scale_data', seed=2, **options)
+
+    assert Product.objects.count() == 40
+    assert Token.objects.count() == Cart.objects.count() == 10
+    assert ProductImage.objects.count() >= 40
+    assert CartProduct.objects.exists()
+    generated = Product.objects.filter(slug__startswith='product-1-')
+    assert list(generated.order_by('pk').values(
+        'name', 'price', 'in_stock')) == [
+            {key: row[key] for key in ('name', 'price', 'in_stock')}
+            for row in ScaleData(2, 4, 20, 2, 5, 3, seed=1,
+                                 using='default').product_rows()
+    ]
+    in_stock = {row['name']: row['in_stock'] for row in ScaleData(
+        2, 4, 20, 2, 5, 3, seed=1, using='default').initial_product_rows()}
+    for product in generated.annotate(reserved=Sum('cartproduct__amount')):
+        assert product.in_stock + (product.reserved or 0) == in_stock[
+            product.name]
+    with pytest.raises(CommandError):
+        call_command('generate_scale_data', seed=1, **options)
+
+
+def test_cart_changelist_totals(admin_client, cart_product, product):
+    '''Тестируем итоги корзин в админке, посчитанные в запросе списка.'''
+    response = admin_client.get('/admin/products/cart/')
+    row = response.context['cl'].result_list[0]
+    assert row.product_names == product.name
+    assert row.total_amount == AMOUNT
+    assert row.total_price == AMOUNT * product.price
+
+
+def test_cart_admin_bulk_delete_query_count(admin_client, product):
+    '''
+    Удаление корзин в админке возвращает товары на склад, и число
+    запросов, кроме журнала админки, не зависит от числа корзин.
+    '''
+    def delete_carts(count):
+        carts = []
+        for i in range(count):
+            user = User.objects.create(username=f'{count}-{i}',
+                                       email=f'{count}-{i}@mail.com',
+                                       password='!')
+            carts.append(Cart.objects.create(user=user))
+            add_to_cart(carts[-1], product, AMOUNT)
+        with CaptureQueriesContext(connection) as queries:
+            admin_client.post('/admin/products/cart/', {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': [cart.pk for cart in carts]})
+        assert not Cart.objects.filter(pk__in=[cart.pk for cart in carts])
+        # Django 4.2 пишет журнал админки по одной записи на объект.
+        return len([query for query in queries.captured_queries
+                    if 'django_admin_log' not in query['sql']])
+
+    assert delete_carts(1) == delete_carts(2)
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+
+
+def test_user_admin_bulk_delete_query_count(admin_client, product):
+    '''
+    Удаление пользователей в админке возвращает на склад товары
+    их корзин, и число запросов не зависит от числа корзин.
+    '''
+    def delete_users(count):
+        users = []
+        for i in range(count):
+            users.append(User.objects.create(
+                username=f'{count}-{i}', email=f'{count}-{i}@mail.com',
+                password='!'))
+            add_to_cart(Cart.objects.create(user=users[-1]), product,
+                        AMOUNT)
+        with CaptureQueriesContext(connection) as queries:
+            admin_client.post('/admin/users/user/', {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': [user.pk for user in users]})
+        assert not User.objects.filter(pk__in=[user.pk for user in users])
+        return len([query for query in queries.captured_queries
+                    if 'django_admin_log' not in query['sql']])
+
+    assert delete_users(1) == delete_users(2)
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+
+
+@pytest.mark.django_db
+def test_estimated_count_paginator(product, settings, monkeypatch):
+    '''
+    Тестируем пагинатор админки: оценка числа строк используется
+    только для больших таблиц.
+    '''
+    monkeypatch.setattr(EstimatedCountPaginator, 'estimate_count',
+                        lambda self: 500)
+    settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 100
+    assert EstimatedCountPaginator(Product.objects.all(), 10).count == 500
+    settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 1000
+    assert EstimatedCountPaginator(Product.objects.all(), 10).count == 1
+
+
+@pytest.mark.django_db
+def test_hot_queries_use_indexes(cart_product, author, product):
+    '''Тестируем планы частых запросов: без полного чтения и сортировок.'''
+    ScaleData(2, 4, 50, 2, 5, 3, seed=1, using='default').generate(100)
+    min_rows = 0
+    if connection.vendor == 'postgresql':
+        # PostgreSQL выбирает план по статистике и маленькие таблицы
+        # читает целиком и сортирует, поэтому частые запросы проверяются
+        # только на таблицах и сортировках продакшен-размера.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        min_rows = 1000
+    for name, queryset in hot_queries(author, product).items():
+        assert plan_problems(queryset, min_rows=min_rows) == [], name
+    assert plan_problems(Product.objects.filter(price=1).order_by(),
+                         min_rows=0) == [
+        f'полное чтение {Product._meta.db_table}']
+    assert plan_problems(Product.objects.order_by('price'),
+                         min_rows=0) == [
+        f'полное чтение {Product._meta.db_table}', 'сортировка без индекса']
+
+
+@pytest.mark.django_db
+def test_expired_reservations_are_released(cart, product):
+    '''
+    Тестируем возврат на склад просроченных резервов пачками:
+    строки, менявшиеся недавно, остаются в корзине.
+    '''
+    other = Product.objects.create(name='other', slug='other',
+                                   type=product.type, price=1, in_stock=5)
+    for item in (product, other):
+        add_to_cart(cart, item, AMOUNT)
+    expired = timezone.now() - timedelta(hours=2)
+    CartProduct.objects.filter(product=product).update(reserved_at=expired)
+    CartProduct.objects.filter(product=other).update(reserved_at=expired)
+    add_to_cart(cart, other, 1)
+
+    stdout = StringIO()
+    call_command('release_expired_reservations', ttl=3600, batch_size=1,
+                 stdout=stdout)
+
+    product.refresh_from_db()
+    other.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+    assert other.in_stock == 5 - AMOUNT - 1
+    assert list(CartProduct.objects.values_list('product', 'amount')) == [
+        (other.pk, AMOUNT + 1)]
+    assert f'Возвращено на склад {AMOUNT} единиц' in stdout.getvalue()
+
+
+def test_stock_shards(author_client, author, product):
+    '''
+    Тестируем остаток, разделенный на части: покупка списывает
+    товар из нескольких частей, если одной не хватает, API
+    показывает сумму частей, перераспределение ее не меняет.
+    '''
+    set_stock_shards(product, 2)
+    assert list(product.shards.values_list('in_stock', flat=True)) == [1, 1]
+
+    response = author_client.post(
+        '/api/cart/batch/', format='json',
+        data={'operations': [{'op': 'add', 'product': product.name,
+                              'amount': IN_STOCK}]})
+    assert response.status_code == HTTPStatus.OK
+    response = author_client.get(f'/api/products/{product.pk}/')
+    assert response.json()['in_stock'] == 0
+
+    author_client.delete('/api/cart/clear-cart/')
+    assert sorted(product.shards.values_list('in_stock', flat=True)) == [
+        0, IN_STOCK]
+    call_command('rebalance_stock_shards', stdout=StringIO())
+    assert list(product.shards.values_list('in_stock', flat=True)) == [1, 1]
+    response = author_client.get('/api/products/')
+    assert response.json()['results'][0]['in_stock'] == IN_STOCK
+
+    call_command('rebalance_stock_shards', product=[product.name], shards=1,
+                 stdout=StringIO())
+    product.refresh_from_db()
+    assert product.in_stock == IN_STOCK
+    assert not ProductStockShard.objects.exists()
+
+
+@pytest.mark.django_db
+def test_rebalance_stock_shards_splits_remainder(product):
+    '''Тестируем перераспределение остатка, не делящегося поровну.'''
+    set_stock_shards(product, 3, 7)
+    product.shards.filter(number=0).update(in_stock=0)
+    rebalance_stock_shards([product.pk])
+    assert list(product.shards.values_list('in_stock', flat=True)) == [
+        2, 1, 1]
+    product.refresh_from_db()
+    assert product.in_stock == 4
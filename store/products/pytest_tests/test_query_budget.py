@@ -0,0 +1,190 @@
+'''
+Бюджеты SQL-запросов для эндпоинтов API и списков в админке.
+Каждый эндпоинт проверяется на каталогах и корзинах нескольких
+размеров: число запросов не должно расти вместе с данными.
+Кэши перед запросом очищаются, поэтому проверяется худший случай.
+'''
+import pytest
+from conftest import PRICE
+from django.core.cache import caches
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from products.models import (Cart, CartProduct, Product, ProductGroup,
+                             ProductImage, Type, User)
+
+SIZES = (1, 5, 20)
+IN_STOCK = 100
+IMAGES_PER_PRODUCT = 3
+
+
+def create_catalog(size):
+    '''
+    Создает size категорий, по две подкатегории в каждой,
+    по продукту в каждой подкатегории и по три изображения продукта.
+    '''
+    groups = ProductGroup.objects.bulk_create(
+        ProductGroup(name=f'Категория {i}', slug=f'group-{i}',
+                     image=f'product_group/{i}.jpg')
+        for i in range(size)
+    )
+    types = Type.objects.bulk_create(
+        Type(name=f'Подкатегория {i}', slug=f'type-{i}',
+             image=f'type/{i}.jpg', product_group=groups[i // 2])
+        for i in range(size * 2)
+    )
+    products = Product.objects.bulk_create(
+        Product(name=f'Продукт {i}', slug=f'product-{i}', type=type_,
+                price=PRICE + i, in_stock=IN_STOCK)
+        for i, type_ in enumerate(types)
+    )
+    ProductImage.objects.bulk_create(
+        ProductImage(product=product, image=f'product/{product.pk}-{i}.jpg')
+        for product in products
+        for i in range(IMAGES_PER_PRODUCT)
+    )
+    return products
+
+
+def create_users(size):
+    '''Создает size пользователей с токенами и корзинами.'''
+    users = User.objects.bulk_create(
+        User(username=f'user{i}', email=f'user{i}@mail.com',
+             password='!')
+        for i in range(size)
+    )
+    Token.objects.bulk_create(Token(user=user, key=Token.generate_key())
+                              for user in users)
+    Cart.objects.bulk_create(Cart(user=user) for user in users)
+    return users
+
+
+def fill_cart(cart, products):
+    CartProduct.objects.bulk_create(
+        CartProduct(cart=cart, product=product, amount=1)
+        for product in products
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: f'size-{size}')
+def catalog(request, db):
+    return create_catalog(request.param)
+
+
+@pytest.fixture
+def user_cart(author, catalog):
+    '''Корзина автора со всеми продуктами, кроме последнего.'''
+    create_users(len(catalog))
+    cart = Cart.objects.create(user=author)
+    fill_cart(cart, catalog[:-1])
+    return cart
+
+
+@pytest.fixture
+def admin_api_client(admin_user):
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=admin_user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def assert_budget(django_assert_max_num_queries, budget, request, *args,
+                  **kwargs):
+    '''Выполняет запрос, прочитав потоковый ответ целиком.'''
+    with django_assert_max_num_queries(budget):
+        response = request(*args, **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    assert response.status_code < 400, response.content
+    return response
+
+
+@pytest.mark.parametrize('url, budget', [
+    ('/api/products/?page_size=100', 5),
+    ('/api/products/?pagination=cursor&page_size=100', 4),
+    ('/api/products/{product}/', 4),
+    ('/api/groups/?page_size=100', 4),
+    ('/api/groups/{group}/', 3),
+    ('/api/types/?page_size=100', 4),
+    ('/api/types/{type}/', 3),
+    ('/api/catalog/?products=true', 3),
+    ('/api/async/products/?page_size=100', 5),
+    ('/api/async/groups/?page_size=100', 4),
+    ('/api/async/types/?page_size=100', 3),
+    ('/api/cart/', 3),
+    ('/api/users/me/', 1),
+])
+def test_read_query_budget(author_client, user_cart, catalog, url, budget,
+                           django_assert_max_num_queries):
+    '''Чтение каталога и корзины пользователем.'''
+    product = catalog[-1]
+    url = url.format(product=product.pk, type=product.type_id,
+                     group=product.type.product_group_id)
+    assert_budget(django_assert_max_num_queries, budget,
+                  author_client.get, url)
+
+
+@pytest.mark.parametrize('url, budget', [
+    ('/api/users/?page_size=100', 3),
+    ('/api/catalog/export/', 2),
+])
+def test_admin_api_query_budget(admin_api_client, user_cart, url, budget,
+                                django_assert_max_num_queries):
+    '''Эндпоинты, доступные только админу.'''
+    assert_budget(django_assert_max_num_queries, budget,
+                  admin_api_client.get, url)
+
+
+def test_add_to_cart_query_budget(author_client, user_cart, catalog,
+                                  django_assert_max_num_queries):
+    assert_budget(django_assert_max_num_queries, 10, author_client.post,
+                  '/api/cart/', {'product': catalog[-1].name, 'amount': 1})
+
+
+def test_cart_batch_query_budget(author_client, user_cart, catalog,
+                                 django_assert_max_num_queries):
+    operations = [{'op': 'set', 'product': product.name, 'amount': 2}
+                  for product in catalog]
+    assert_budget(django_assert_max_num_queries, 13, author_client.post,
+                  '/api/cart/batch/', {'operations': operations},
+                  format='json')
+
+
+def test_update_product_query_budget(author_client, user_cart, catalog,
+                                     django_assert_max_num_queries):
+    assert_budget(django_assert_max_num_queries, 7, author_client.patch,
+                  '/api/cart/update-product/',
+                  {'product': catalog[0].name, 'amount': 2})
+
+
+def test_remove_product_query_budget(author_client, user_cart, catalog,
+                                     django_assert_max_num_queries):
+    assert_budget(django_assert_max_num_queries, 7, author_client.delete,
+                  '/api/cart/remove-product/',
+                  {'product': catalog[0].name})
+
+
+def test_clear_cart_query_budget(author_client, user_cart,
+                                 django_assert_max_num_queries):
+    assert_budget(django_assert_max_num_queries, 9, author_client.delete,
+                  '/api/cart/clear-cart/')
+
+
+@pytest.mark.parametrize('url, budget', [
+    ('/admin/products/productgroup/', 11),
+    ('/admin/products/type/', 12),
+    ('/admin/products/product/', 12),
+    ('/admin/products/cart/', 10),
+    ('/admin/users/user/', 10),
+])
+def test_admin_changelist_query_budget(admin_client, user_cart, url, budget,
+                                       django_assert_max_num_queries):
+    '''Списки объектов в админке.'''
+    assert_budget(django_assert_max_num_queries, budget,
+                  admin_client.get, url)
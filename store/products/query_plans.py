@@ -0,0 +1,123 @@
+'''
+Проверка планов частых запросов API: EXPLAIN запроса не должен
+содержать полного чтения больших таблиц и сортировки без индекса.
+'''
+import json
+import math
+import re
+
+from django.db import connections
+
+from .models import (Cart, CartProduct, Product, ProductGroup, ProductImage,
+                     ProductStockShard, Type)
+
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)(.*)$')
+INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+SORTS = ('Sort', 'Incremental Sort')
+
+
+def hot_queries(user, product):
+    '''
+    Запросы того же вида, что выполняют представления API
+    для пользователя user и продукта product.
+    '''
+    product_type = product.type
+    return {
+        'Товары в корзине пользователя': CartProduct.objects.filter(
+            cart__user=user).values_list('product_id', flat=True),
+        'Товар в корзине по названию': CartProduct.objects.filter(
+            cart__user=user, product__name=product.name),
+        'Корзина с итогами': Cart.objects.filter(
+            user=user).annotate_totals(),
+        'Страница продуктов': Product.objects.select_related(
+            'type__product_group')[:10],
+        'Изображения продуктов': ProductImage.objects.filter(
+            product_id__in=[product.pk]),
+        'Подкатегории категории': Type.objects.filter(
+            product_group_id=product_type.product_group_id),
+        'Продукт по названию': Product.objects.filter(name=product.name),
+        'Подкатегория по названию': Type.objects.filter(
+            name=product_type.name),
+        'Категория по названию': ProductGroup.objects.filter(
+            name=product_type.product_group.name),
+        'Часть остатка продукта': ProductStockShard.objects.filter(
+            product_id=product.pk, number=0),
+    }
+
+
+def table_rows(connection, table):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                [table])
+        else:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def iter_plan_nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from iter_plan_nodes(child)
+
+
+def scanned_tables(queryset):
+    '''
+    Таблицы, которые запрос читает целиком. Чтение всего индекса
+    в нужном порядке допустимо только для запроса с LIMIT.
+    '''
+    connection = connections[queryset.db]
+    limited = queryset.query.is_sliced
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        return {
+            node['Relation Name'] for node in iter_plan_nodes(plan)
+            if node['Node Type'] == 'Seq Scan'
+            or (node['Node Type'] in INDEX_SCANS and not limited
+                and 'Index Cond' not in node)
+        }
+    tables = set()
+    for line in queryset.explain().splitlines():
+        match = SQLITE_SCAN.search(line)
+        if match and not (limited and 'USING' in match.group(2)):
+            tables.add(match.group(1))
+    return tables
+
+
+def sorted_rows(queryset):
+    '''
+    Число строк, которые запрос сортирует после чтения, 0 - если
+    порядок дает индекс. SQLite не оценивает число строк, поэтому
+    для него любая сортировка считается большой.
+    '''
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        return max([node['Plan Rows'] for node in iter_plan_nodes(plan)
+                    if node['Node Type'] in SORTS], default=0)
+    if 'USE TEMP B-TREE FOR ORDER BY' in queryset.explain():
+        return math.inf
+    return 0
+
+
+def full_scans(queryset, min_rows):
+    '''Таблицы больше min_rows строк, которые запрос читает целиком.'''
+    connection = connections[queryset.db]
+    return sorted(table for table in scanned_tables(queryset)
+                  if table_rows(connection, table) > min_rows)
+
+
+def plan_problems(queryset, min_rows):
+    '''
+    Недостатки плана запроса: полное чтение таблиц больше min_rows
+    строк и сортировка больше min_rows строк, например из-за
+    Meta.ordering, которому не соответствует ни один индекс.
+    '''
+    problems = [f'полное чтение {table}'
+                for table in full_scans(queryset, min_rows)]
+    if sorted_rows(queryset) > min_rows:
+        problems.append('сортировка без индекса')
+    return problems
@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Cart, CartProduct, ProductGroup, ProductImage, Type
+from .renditions import needs_rendition, schedule_thumbnail
+from .services import release_cart_products
+
+_cart_stock_released = ContextVar('cart_stock_released', default=False)
+
+
+@contextmanager
+def cart_stock_released():
+    '''
+    Удаление корзин, товары которых уже возвращены на склад
+    одним запросом: обработчик удаления не проверяет каждую корзину.
+    '''
+    token = _cart_stock_released.set(True)
+    try:
+        yield
+    finally:
+        _cart_stock_released.reset(token)
+
+
+@receiver(pre_delete, sender=Cart)
+def release_deleted_cart_stock(sender, instance, using, **kwargs):
+    '''
+    Возвращает на склад товары удаляемой корзины,
+    в том числе при каскадном удалении пользователя.
+    '''
+    if _cart_stock_released.get():
+        return
+    release_cart_products(CartProduct.objects.using(using).filter(
+        cart=instance))
+
+
+def create_thumbnail(sender, instance, raw, update_fields, **kwargs):
+    '''Запускает создание миниатюры для нового изображения.'''
+    if raw or (update_fields and 'thumbnail' in update_fields):
+        return
+    if needs_rendition(instance):
+        schedule_thumbnail(instance)
+
+
+for model in (ProductGroup, Type, ProductImage):
+    post_save.connect(create_thumbnail, sender=model)
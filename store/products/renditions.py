@@ -0,0 +1,110 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+RENDITION_FORMAT = 'WEBP'
+RENDITION_QUALITY = 80
+
+_executor = None
+
+
+def get_executor():
+    '''Пул потоков для генерации миниатюр создается при первом обращении.'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='renditions'
+        )
+    return _executor
+
+
+def rendition_name(image_name) -> str:
+    '''Имя миниатюры однозначно определяется именем оригинала.'''
+    return str(PurePosixPath('renditions', image_name).with_suffix('.webp'))
+
+
+def needs_rendition(instance) -> bool:
+    return bool(instance.image) and (
+        instance.thumbnail.name != rendition_name(instance.image.name))
+
+
+def render_thumbnail(model, pk):
+    '''
+    Создает уменьшенную копию изображения в формате WebP
+    и сохраняет ссылку на нее в поле thumbnail.
+    '''
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_rendition(instance):
+        return
+    size = settings.IMAGE_RENDITION_SIZE
+    buffer = BytesIO()
+    with instance.image.open('rb') as source, Image.open(source) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(buffer, RENDITION_FORMAT, quality=RENDITION_QUALITY)
+
+    name = rendition_name(instance.image.name)
+    storage = instance.thumbnail.storage
+    if storage.exists(name):
+        storage.delete(name)
+    instance.thumbnail.name = storage.save(name,
+                                           ContentFile(buffer.getvalue()))
+    if model.objects.filter(pk=pk, image=instance.image.name).exists():
+        instance.save(update_fields=['thumbnail'])
+
+
+def _render_in_background(model, pk):
+    close_old_connections()
+    try:
+        render_thumbnail(model, pk)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s %s',
+                         model._meta.label, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnail(instance):
+    '''
+    Ставит генерацию миниатюры в очередь после фиксации транзакции,
+    чтобы запрос не ждал обработки изображения.
+    При IMAGE_RENDITION_WORKERS = 0 миниатюра создается сразу.
+    '''
+    model, pk = type(instance), instance.pk
+    if settings.IMAGE_RENDITION_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(_render_in_background, model, pk))
+    else:
+        transaction.on_commit(lambda: render_thumbnail(model, pk))
+
+
+def render_missing_thumbnails(models):
+    '''
+    Создает миниатюры для изображений, у которых их еще нет,
+    например после массового импорта. Возвращает число изображений.
+    '''
+    count = 0
+    futures = []
+    for model in models:
+        pks = model.objects.filter(thumbnail='').exclude(
+            image='').values_list('pk', flat=True)
+        for pk in pks.iterator():
+            count += 1
+            if settings.IMAGE_RENDITION_WORKERS:
+                futures.append(get_executor().submit(
+                    _render_in_background, model, pk))
+            else:
+                render_thumbnail(model, pk)
+    for future in futures:
+        future.result()
+    return count
@@ -0,0 +1,245 @@
+'''
+Синтетические данные для проверки приложения на объемах продакшена.
+Строки создаются генераторами без объектов моделей и записываются
+пачками: в PostgreSQL через COPY, в других базах через bulk_create.
+Одинаковый seed дает одинаковые данные.
+'''
+import io
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from rest_framework.authtoken.models import Token
+
+from .models import (Cart, CartProduct, Product, ProductGroup, ProductImage,
+                     Type)
+from .signals import catalog_changed
+from users.models import User
+
+USERNAME = 'user'
+IN_STOCK_RANGE = (0, 1000)
+PRICE_RANGE = (50, 5000)
+STARTED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                              '\r': '\\r'})
+
+
+def iter_batches(rows, batch_size):
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def copy_value(value):
+    '''Значение в текстовом формате COPY.'''
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(connection, model, batch):
+    '''Записывает пачку строк в таблицу модели командой COPY.'''
+    columns = {field.attname: field.column
+               for field in model._meta.concrete_fields}
+    names = list(batch[0])
+    buffer = io.StringIO()
+    for row in batch:
+        buffer.write('\t'.join(copy_value(row[name]) for name in names))
+        buffer.write('\n')
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f'COPY {quote(model._meta.db_table)} '
+            f'({", ".join(quote(columns[name]) for name in names)}) '
+            f'FROM STDIN',
+            buffer)
+
+
+def write_rows(connection, model, rows, batch_size):
+    '''Записывает строки пачками по batch_size, возвращает их число.'''
+    count = 0
+    for batch in iter_batches(rows, batch_size):
+        if connection.vendor == 'postgresql':
+            copy_rows(connection, model, batch)
+        else:
+            model.objects.using(connection.alias).bulk_create(
+                [model(**row) for row in batch])
+        count += len(batch)
+    return count
+
+
+def next_id(model, using):
+    return (model.objects.using(using).aggregate(
+        max_id=Max('pk'))['max_id'] or 0) + 1
+
+
+class ScaleData:
+    '''
+    Генератор каталога, пользователей, токенов и корзин.
+    Остаток продуктов случайный, если не задан in_stock, товары
+    корзин вычитаются из него.
+    Идентификаторы выдаются подряд после существующих, названия
+    и имена пользователей содержат seed, поэтому данные с разными
+    seed можно создавать в одной базе.
+    '''
+
+    def __init__(self, groups, types, products, images, users,
+                 cart_products, seed, using, in_stock=None):
+        self.counts = {'groups': groups, 'types': types,
+                       'products': products, 'users': users}
+        self.images = images
+        self.in_stock = in_stock
+        self.cart_products = min(cart_products, products)
+        self.seed = seed
+        self.using = using
+        # COPY не подставляет значения по умолчанию из модели.
+        self.reserved_at = datetime.now(timezone.utc)
+        self.first_ids = {model: next_id(model, using) for model in
+                          (ProductGroup, Type, Product, User, Cart)}
+
+    def rng(self, name):
+        # Отдельный генератор на каждую таблицу: строки таблицы не зависят
+        # от размеров остальных таблиц.
+        return random.Random(f'{self.seed}:{name}')
+
+    def ids(self, model, count):
+        first = self.first_ids[model]
+        return range(first, first + count)
+
+    def exists(self):
+        return ProductGroup.objects.using(self.using).filter(
+            slug=f'group-{self.seed}-0').exists()
+
+    def group_rows(self):
+        for i, pk in enumerate(self.ids(ProductGroup,
+                                        self.counts['groups'])):
+            yield {'id': pk, 'name': f'Категория {self.seed}-{i}',
+                   'slug': f'group-{self.seed}-{i}',
+                   'image': f'product_group/{self.seed}-{i}.jpg',
+                   'thumbnail': ''}
+
+    def type_rows(self):
+        group_ids = self.ids(ProductGroup, self.counts['groups'])
+        for i, pk in enumerate(self.ids(Type, self.counts['types'])):
+            yield {'id': pk, 'name': f'Подкатегория {self.seed}-{i}',
+                   'slug': f'type-{self.seed}-{i}',
+                   'image': f'type/{self.seed}-{i}.jpg', 'thumbnail': '',
+                   'product_group_id': group_ids[i % len(group_ids)]}
+
+    def initial_product_rows(self):
+        '''Строки продуктов с остатком до резервов в корзинах.'''
+        rng = self.rng('products')
+        type_ids = self.ids(Type, self.counts['types'])
+        for i, pk in enumerate(self.ids(Product, self.counts['products'])):
+            yield {'id': pk, 'name': f'Продукт {self.seed}-{i}',
+                   'slug': f'product-{self.seed}-{i}',
+                   'type_id': rng.choice(type_ids),
+                   'price': rng.randint(*PRICE_RANGE),
+                   'in_stock': (rng.randint(*IN_STOCK_RANGE)
+                                if self.in_stock is None
+                                else self.in_stock),
+                   'stock_shards': 1}
+
+    def initial_stock(self):
+        return {row['id']: row['in_stock']
+                for row in self.initial_product_rows()}
+
+    def product_rows(self):
+        '''
+        Строки продуктов с остатком за вычетом товаров в корзинах:
+        возврат просроченных резервов восстанавливает исходный остаток.
+        '''
+        stock = self.initial_stock()
+        deque(self.reserve_cart_products(stock), maxlen=0)
+        for row in self.initial_product_rows():
+            yield {**row, 'in_stock': stock[row['id']]}
+
+    def image_rows(self):
+        rng = self.rng('images')
+        for product_id in self.ids(Product, self.counts['products']):
+            for i in range(rng.randint(1, self.images)):
+                yield {'product_id': product_id,
+                       'image': f'product/{product_id}-{i}.jpg',
+                       'thumbnail': ''}
+
+    def user_rows(self):
+        for i, pk in enumerate(self.ids(User, self.counts['users'])):
+            username = f'{USERNAME}{self.seed}-{i}'
+            yield {'id': pk, 'username': username,
+                   'email': f'{username}@mail.com', 'password': '!',
+                   'first_name': '', 'last_name': '', 'is_staff': False,
+                   'is_superuser': False, 'is_active': True,
+                   'last_login': None,
+                   'date_joined': STARTED_AT + timedelta(minutes=i)}
+
+    def token_rows(self):
+        rng = self.rng('tokens')
+        for i, user_id in enumerate(self.ids(User, self.counts['users'])):
+            yield {'key': f'{rng.getrandbits(160):040x}',
+                   'user_id': user_id,
+                   'created': STARTED_AT + timedelta(minutes=i)}
+
+    def cart_rows(self):
+        for pk, user_id in zip(self.ids(Cart, self.counts['users']),
+                               self.ids(User, self.counts['users'])):
+            yield {'id': pk, 'user_id': user_id}
+
+    def reserve_cart_products(self, stock):
+        '''
+        Строки корзин. Количество товара не больше его остатка в stock,
+        остаток уменьшается на количество в корзине.
+        '''
+        rng = self.rng('cart_products')
+        product_ids = self.ids(Product, self.counts['products'])
+        for cart_id in self.ids(Cart, self.counts['users']):
+            for product_id in rng.sample(
+                    product_ids, rng.randint(0, self.cart_products)):
+                amount = min(rng.randint(1, 5), stock[product_id])
+                if not amount:
+                    continue
+                stock[product_id] -= amount
+                yield {'cart_id': cart_id, 'product_id': product_id,
+                       'amount': amount, 'reserved_at': self.reserved_at}
+
+    def cart_product_rows(self):
+        return self.reserve_cart_products(self.initial_stock())
+
+    def tables(self):
+        return (
+            (ProductGroup, self.group_rows),
+            (Type, self.type_rows),
+            (Product, self.product_rows),
+            (ProductImage, self.image_rows),
+            (User, self.user_rows),
+            (Token, self.token_rows),
+            (Cart, self.cart_rows),
+            (CartProduct, self.cart_product_rows),
+        )
+
+    def generate(self, batch_size, progress=None):
+        '''
+        Записывает все таблицы в одной транзакции. progress вызывается
+        после каждой таблицы с моделью, числом строк и временем записи.
+        '''
+        connection = connections[self.using]
+        with transaction.atomic(using=self.using):
+            for model, rows in self.tables():
+                started = time.monotonic()
+                count = write_rows(connection, model, rows(), batch_size)
+                if progress is not None:
+                    progress(model, count, time.monotonic() - started)
+            # Идентификаторы записаны явно, последовательности PostgreSQL
+            # нужно сдвинуть за них.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), [model for model, _ in self.tables()]):
+                    cursor.execute(sql)
+        catalog_changed.send(sender=Product)
@@ -0,0 +1,444 @@
+import random
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import (Case, Count, F, IntegerField, Subquery, Sum,
+                              Value, When)
+from django.utils import timezone
+
+from .models import CartProduct, Product, ProductStockShard
+from .signals import stock_changed
+from store.constans import MAX_CART_AMOUNT, MIN_NUM
+
+ADD = 'add'
+SET = 'set'
+REMOVE = 'remove'
+CART_OPERATIONS = (ADD, SET, REMOVE)
+
+
+def reserve_stock(product, amount):
+    '''
+    Списывает amount единиц товара одним условным UPDATE
+    без блокировки строки на время запроса. Остаток продукта,
+    разделенного на части, списывается из случайной части.
+    Если товара недостаточно, остаток не меняется.
+    '''
+    if product.stock_shards > 1:
+        reserved = _reserve_random_shard(product.pk, product.stock_shards,
+                                         amount)
+    else:
+        reserved = Product.objects.filter(
+            pk=product.pk, stock_shards=1, in_stock__gte=amount
+        ).update(in_stock=F('in_stock') - amount)
+    if not reserved:
+        _reserve_stock_locked(product, amount)
+    stock_changed.send(sender=Product, product_ids=[product.pk])
+
+
+def _reserve_random_shard(product_id, shards, amount):
+    return ProductStockShard.objects.filter(
+        product_id=product_id, number=random.randrange(shards),
+        in_stock__gte=amount
+    ).update(in_stock=F('in_stock') - amount)
+
+
+def _reserve_stock_locked(product, amount):
+    '''
+    Списание, если в случайной части остатка товара не хватило:
+    части блокируются по порядку номеров, и товар списывается
+    из нескольких частей одним UPDATE. Число частей перечитывается,
+    так как продукт могли разделить или объединить после загрузки.
+    '''
+    stock_shards, available = Product.objects.values_list(
+        'stock_shards', 'in_stock').get(pk=product.pk)
+    if stock_shards == 1:
+        if product.stock_shards != 1 and Product.objects.filter(
+                pk=product.pk, stock_shards=1, in_stock__gte=amount
+        ).update(in_stock=F('in_stock') - amount):
+            return
+    else:
+        with transaction.atomic():
+            shards = list(ProductStockShard.objects.select_for_update(
+            ).filter(product_id=product.pk).order_by(
+                'number').values_list('pk', 'in_stock'))
+            available = sum(in_stock for _, in_stock in shards)
+            if available >= amount:
+                taken = {}
+                for pk, in_stock in shards:
+                    if amount == 0:
+                        break
+                    taken[pk] = min(in_stock, amount)
+                    amount -= taken[pk]
+                ProductStockShard.objects.filter(pk__in=taken).update(
+                    in_stock=F('in_stock') - _amount_by_pk(taken))
+                return
+    raise ValidationError(
+        f'Недостаточно товара {product.name} на складе. '
+        f'Доступно: {available}.')
+
+
+def release_stock(product_id, amount):
+    '''Возвращает amount единиц товара на склад.'''
+    if not Product.objects.filter(pk=product_id, stock_shards=1).update(
+            in_stock=F('in_stock') + amount):
+        _release_to_random_shard(product_id, amount)
+    stock_changed.send(sender=Product, product_ids=[product_id])
+
+
+def _release_to_random_shard(product_id, amount):
+    shard = ProductStockShard.objects.filter(
+        product_id=product_id).order_by('?').values('pk')[:1]
+    ProductStockShard.objects.filter(pk__in=Subquery(shard)).update(
+        in_stock=F('in_stock') + amount)
+
+
+def _amount_by_pk(amounts):
+    return Case(
+        *[When(pk=pk, then=Value(amount))
+          for pk, amount in amounts.items()],
+        output_field=IntegerField()
+    )
+
+
+def reserve_stock_bulk(amounts):
+    '''
+    Списывает остатки нескольких товаров одним условным UPDATE.
+    amounts - словарь {id товара: количество}. Остатки продуктов,
+    разделенных на части, списываются по одному продукту. Если
+    хотя бы одного товара недостаточно, остатки не меняются.
+    '''
+    if not amounts:
+        return
+    needed = _amount_by_pk(amounts)
+    with transaction.atomic():
+        reserved = Product.objects.filter(
+            pk__in=amounts, stock_shards=1, in_stock__gte=needed
+        ).update(in_stock=F('in_stock') - needed)
+        if reserved == len(amounts):
+            stock_changed.send(sender=Product, product_ids=list(amounts))
+            return
+        transaction.set_rollback(True)
+    products = Product.objects.filter(pk__in=amounts).only(
+        'name', 'in_stock', 'stock_shards')
+    sharded = [product for product in products if product.stock_shards > 1]
+    if sharded:
+        with transaction.atomic():
+            reserve_stock_bulk({
+                product.pk: amounts[product.pk] for product in products
+                if product.stock_shards == 1})
+            for product in sharded:
+                reserve_stock(product, amounts[product.pk])
+        return
+    raise ValidationError([
+        f'Недостаточно товара {product.name} на складе. '
+        f'Доступно: {product.in_stock}.'
+        for product in products if product.in_stock < amounts[product.pk]
+    ])
+
+
+def release_stock_bulk(amounts):
+    '''
+    Возвращает на склад остатки нескольких товаров одним UPDATE.
+    amounts - словарь {id товара: количество}.
+    '''
+    if not amounts:
+        return
+    released = Product.objects.filter(
+        pk__in=amounts, stock_shards=1
+    ).update(in_stock=F('in_stock') + _amount_by_pk(amounts))
+    if released < len(amounts):
+        for product_id in Product.objects.filter(
+                pk__in=amounts, stock_shards__gt=1).values_list(
+                    'pk', flat=True):
+            _release_to_random_shard(product_id, amounts[product_id])
+    stock_changed.send(sender=Product, product_ids=list(amounts))
+
+
+def release_cart_products(cart_products, skip_locked=False):
+    '''
+    Возвращает на склад товары из строк корзин queryset-а и удаляет
+    эти строки. Количество запросов не зависит от числа строк:
+    строки блокируются одним SELECT, остатки возвращаются одним
+    UPDATE ... FROM с группировкой по товару, строки удаляются
+    одним DELETE. С skip_locked строки корзин и товаров,
+    заблокированные другими транзакциями, не ожидаются, а
+    пропускаются. Возвращает число удаленных строк и возвращенных
+    единиц товара.
+    '''
+    db = router.db_for_write(CartProduct)
+    with transaction.atomic(using=db):
+        locked = list(cart_products.select_for_update(
+            of=('self',), skip_locked=skip_locked
+        ).order_by('pk').values_list('pk', 'product_id', 'amount'))
+        if skip_locked and locked:
+            free = set(Product.objects.using(db).filter(
+                pk__in={product_id for _, product_id, _ in locked}
+            ).select_for_update(skip_locked=True).values_list(
+                'pk', flat=True))
+            locked = [line for line in locked if line[1] in free]
+        if not locked:
+            return 0, 0
+        lines = CartProduct.objects.using(db).filter(
+            pk__in=[pk for pk, _, _ in locked])
+        released = lines.order_by().values('product_id').annotate(
+            released=Sum('amount'))
+        released_sql, params = released.query.sql_with_params()
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        table = quote(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} '
+                f'SET in_stock = {table}.in_stock + released.released '
+                f'FROM ({released_sql}) AS released '
+                f'WHERE {table}.id = released.product_id '
+                f'AND {table}.stock_shards = 1',
+                params)
+            if cursor.rowcount < len({line[1] for line in locked}):
+                # Товары с частями остатка возвращаются в случайную часть.
+                shards = quote(ProductStockShard._meta.db_table)
+                cursor.execute(
+                    f'UPDATE {shards} '
+                    f'SET in_stock = {shards}.in_stock + released.released '
+                    f'FROM ({released_sql}) AS released '
+                    f'WHERE {shards}.id = ('
+                    f'SELECT shard.id FROM {shards} AS shard '
+                    f'WHERE shard.product_id = released.product_id '
+                    f'ORDER BY RANDOM() LIMIT 1)',
+                    params)
+        lines.delete()
+    stock_changed.send(sender=Product, product_ids=None)
+    return len(locked), sum(amount for _, _, amount in locked)
+
+
+def release_expired_reservations(expired_before, batch_size):
+    '''
+    Возвращает на склад одну пачку из не более batch_size строк
+    корзин, не менявшихся с expired_before. Строки выбираются
+    по индексу reserved_at, каждая пачка - отдельная короткая
+    транзакция. Строки корзин и товаров, которые сейчас меняют
+    покупатели, пропускаются до следующей пачки. Возвращает число
+    строк и единиц товара.
+    '''
+    ids = list(CartProduct.objects.filter(
+        reserved_at__lt=expired_before
+    ).order_by('reserved_at').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0, 0
+    # Условие повторяется: строку могли изменить после выбора пачки.
+    return release_cart_products(
+        CartProduct.objects.filter(pk__in=ids,
+                                   reserved_at__lt=expired_before),
+        skip_locked=True)
+
+
+@transaction.atomic
+def add_to_cart(cart, product, amount):
+    '''Добавляет товар в корзину, списывая его со склада.'''
+    if amount < MIN_NUM:
+        raise ValidationError('Количество должно быть больше 0.')
+    reserve_stock(product, amount)
+    cart_product, created = CartProduct.objects.get_or_create(
+        cart=cart, product=product, defaults={'amount': amount})
+    if not created:
+        cart_product.reserved_at = timezone.now()
+        if not CartProduct.objects.filter(
+                pk=cart_product.pk, amount__lte=MAX_CART_AMOUNT - amount
+        ).update(amount=F('amount') + amount,
+                 reserved_at=cart_product.reserved_at):
+            raise ValidationError(_too_many(product.name))
+        cart_product.amount += amount
+    return cart_product
+
+
+@transaction.atomic
+def save_cart_product(cart_product):
+    '''
+    Сохраняет товар в корзине и меняет остаток на складе
+    на разницу с сохраненным количеством.
+    '''
+    if cart_product.pk is None:
+        reserve_stock(cart_product.product, cart_product.amount)
+    else:
+        original = CartProduct.objects.select_for_update().values(
+            'product_id', 'amount').get(pk=cart_product.pk)
+        if original['product_id'] != cart_product.product_id:
+            release_stock(original['product_id'], original['amount'])
+            reserve_stock(cart_product.product, cart_product.amount)
+        else:
+            diff = cart_product.amount - original['amount']
+            if diff > 0:
+                reserve_stock(cart_product.product, diff)
+            elif diff < 0:
+                release_stock(cart_product.product_id, -diff)
+    cart_product.reserved_at = timezone.now()
+    cart_product.save()
+    return cart_product
+
+
+@transaction.atomic
+def remove_from_cart(cart_product):
+    '''Удаляет товар из корзины и возвращает его на склад.'''
+    amount = CartProduct.objects.select_for_update().values_list(
+        'amount', flat=True).get(pk=cart_product.pk)
+    CartProduct.objects.filter(pk=cart_product.pk).delete()
+    release_stock(cart_product.product_id, amount)
+
+
+def _too_many(name):
+    return (f'Количество товара {name} в корзине должно быть '
+            f'не больше {MAX_CART_AMOUNT}.')
+
+
+def _apply_operations(amounts, operations, products):
+    '''Меняет количества amounts {id товара: количество} операциями.'''
+    for operation in operations:
+        product_id = products[operation['product']].pk
+        if operation['op'] == ADD:
+            amounts[product_id] = (amounts.get(product_id, 0)
+                                   + operation['amount'])
+        elif operation['op'] == SET:
+            amounts[product_id] = operation['amount']
+        else:
+            amounts.pop(product_id, None)
+
+
+def _stock_changes(amounts, cart_products):
+    '''
+    Разница новых количеств с количествами в корзине: словари
+    единиц к списанию и к возврату на склад.
+    '''
+    to_reserve, to_release = {}, {}
+    for product_id in amounts.keys() | cart_products.keys():
+        original = (cart_products[product_id].amount
+                    if product_id in cart_products else 0)
+        diff = amounts.get(product_id, 0) - original
+        if diff > 0:
+            to_reserve[product_id] = diff
+        elif diff < 0:
+            to_release[product_id] = -diff
+    return to_reserve, to_release
+
+
+@transaction.atomic
+def apply_cart_operations(cart, operations):
+    '''
+    Применяет к корзине список операций add/set/remove
+    в одной транзакции. Товары и строки корзины читаются
+    одним запросом, остатки списываются и возвращаются
+    одним UPDATE каждое. Удаление отсутствующего в корзине
+    товара ничего не меняет.
+    '''
+    names = {operation['product'] for operation in operations}
+    products = {product.name: product
+                for product in Product.objects.filter(name__in=names)}
+    missing = names - products.keys()
+    if missing:
+        raise ValidationError(
+            f'Товары не найдены: {", ".join(sorted(missing))}.')
+
+    cart_products = {
+        cart_product.product_id: cart_product
+        for cart_product in CartProduct.objects.select_for_update().filter(
+            cart=cart, product__in=products.values())
+    }
+    amounts = {product_id: cart_product.amount
+               for product_id, cart_product in cart_products.items()}
+    _apply_operations(amounts, operations, products)
+    too_many = [_too_many(product.name) for product in products.values()
+                if amounts.get(product.pk, 0) > MAX_CART_AMOUNT]
+    if too_many:
+        raise ValidationError(too_many)
+    to_reserve, to_release = _stock_changes(amounts, cart_products)
+    reserve_stock_bulk(to_reserve)
+    release_stock_bulk(to_release)
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for product_id, amount in amounts.items():
+        cart_product = cart_products.get(product_id)
+        if cart_product is None:
+            to_create.append(CartProduct(cart=cart, product_id=product_id,
+                                         amount=amount, reserved_at=now))
+        elif cart_product.amount != amount:
+            cart_product.amount = amount
+            cart_product.reserved_at = now
+            to_update.append(cart_product)
+    CartProduct.objects.bulk_create(to_create)
+    CartProduct.objects.bulk_update(to_update, ['amount', 'reserved_at'])
+    removed = cart_products.keys() - amounts.keys()
+    if removed:
+        CartProduct.objects.filter(cart=cart,
+                                   product_id__in=removed).delete()
+
+
+def _split_stock(in_stock, shards):
+    '''Остаток in_stock, разделенный на shards частей поровну.'''
+    return [in_stock // shards + (number < in_stock % shards)
+            for number in range(shards)]
+
+
+@transaction.atomic
+def set_stock_shards(product, shards, in_stock=None):
+    '''
+    Делит остаток продукта на shards частей поровну, с shards
+    равным 1 - собирает его обратно в Product.in_stock.
+    in_stock - новый остаток, без него сохраняется текущий.
+    '''
+    current_shards, current = Product.objects.select_for_update(
+    ).values_list('stock_shards', 'in_stock').get(pk=product.pk)
+    shard_stock = list(ProductStockShard.objects.select_for_update().filter(
+        product=product).values_list('in_stock', flat=True))
+    if in_stock is None:
+        in_stock = current if current_shards == 1 else sum(shard_stock)
+    ProductStockShard.objects.filter(product=product).delete()
+    if shards > 1:
+        ProductStockShard.objects.bulk_create(
+            ProductStockShard(product=product, number=number,
+                              in_stock=shard_in_stock)
+            for number, shard_in_stock in enumerate(
+                _split_stock(in_stock, shards)))
+    Product.objects.filter(pk=product.pk).update(stock_shards=shards,
+                                                 in_stock=in_stock)
+    product.stock_shards, product.in_stock = shards, in_stock
+    stock_changed.send(sender=Product, product_ids=[product.pk])
+
+
+def rebalance_stock_shards(product_ids):
+    '''
+    Поровну перераспределяет остаток продуктов product_ids между
+    их частями и записывает сумму частей в Product.in_stock.
+    Части блокируются одним SELECT по порядку, остатки меняются
+    двумя UPDATE ... FROM, сумма остатков не меняется.
+    '''
+    db = router.db_for_write(ProductStockShard)
+    with transaction.atomic(using=db):
+        shards = ProductStockShard.objects.using(db).filter(
+            product_id__in=product_ids)
+        # Суммы считаются после блокировки: их не изменит
+        # покупка, выполняемая одновременно.
+        list(shards.select_for_update().order_by('pk').values_list('pk'))
+        totals = shards.order_by().values('product_id').annotate(
+            total=Sum('in_stock'), shards=Count('pk'))
+        totals_sql, params = totals.query.sql_with_params()
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        table = quote(ProductStockShard._meta.db_table)
+        products = quote(Product._meta.db_table)
+        with connection.cursor() as cursor:
+            # Запрос выполняется с параметрами, поэтому остаток от деления
+            # записывается как %%: одиночный % psycopg2 считает
+            # подстановкой параметра.
+            cursor.execute(
+                f'UPDATE {table} '
+                f'SET in_stock = totals.total / totals.shards + CASE '
+                f'WHEN {table}.number < totals.total %% totals.shards '
+                f'THEN 1 ELSE 0 END '
+                f'FROM ({totals_sql}) AS totals '
+                f'WHERE {table}.product_id = totals.product_id',
+                params)
+            cursor.execute(
+                f'UPDATE {products} SET in_stock = totals.total '
+                f'FROM ({totals_sql}) AS totals '
+                f'WHERE {products}.id = totals.product_id',
+                params)
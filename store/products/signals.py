@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Отправляется после изменения остатков товаров запросом UPDATE,
+# который не вызывает post_save. Аргумент product_ids - id товаров
+# или None, если они неизвестны.
+stock_changed = Signal()
+
+# Отправляется после массового изменения каталога через bulk_create
+# и bulk_update, которые не вызывают post_save.
+catalog_changed = Signal()
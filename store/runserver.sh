@@ -1,10 +1,11 @@
 #!/usr/bin/env sh
 
-python manage.py makemigrations
-python manage.py migrate --noinput
-python manage.py initadmin
-python manage.py loaddata products.json
-python manage.py collectstatic --noinput
-cp -r /app/static/. /backend_static/static/
+python manage.py bootstrap
 
-gunicorn --bind 0.0.0.0:8888 store.wsgi --access-logfile -
\ No newline at end of file
+# SERVER_MODE=asgi: uvicorn-воркеры, асинхронные представления /api/async/
+# обслуживают тысячи одновременных соединений в одном процессе.
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn --bind 0.0.0.0:8888 store.asgi -k uvicorn.workers.UvicornWorker --access-logfile -
+fi
+
+exec gunicorn --bind 0.0.0.0:8888 store.wsgi --access-logfile -
\ No newline at end of file
@@ -4,3 +4,6 @@ MAX_LENGTH = 20
 EMAIL_LENGTH = 40
 USER_MAX_LENGTH = 100
 MIN_NUM_IN_STOCK = 0
+CART_BATCH_MAX_OPERATIONS = 100
+MAX_STOCK_SHARDS = 64
+MAX_CART_AMOUNT = 32767
@@ -0,0 +1,29 @@
+from django_prometheus.db.backends.postgresql import base
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''
+    PostgreSQL с метриками django_prometheus и пулом соединений.
+    Django закрывает соединение в конце запроса (CONN_MAX_AGE = 0),
+    а этот класс вместо закрытия возвращает его в пул процесса.
+    '''
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        connection, self._pool_created = pool.checkout(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params))
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = get_pool(self.alias, self.settings_dict)
+        if self.in_atomic_block:
+            # Соединение закрывается внутри транзакции, Django еще
+            # будет к нему обращаться, поэтому в пул оно не попадает.
+            pool.discard(self.connection)
+        else:
+            pool.release(self.connection, self._pool_created)
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from prometheus_client import Counter, Gauge, Histogram
+from psycopg2 import Error as DatabaseError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+
+pool_wait_seconds = Histogram(
+    'django_db_pool_wait_seconds',
+    'Time spent waiting for a connection from the pool.',
+    ['alias'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+             2.5, 5, 10),
+)
+pool_checkouts_total = Counter(
+    'django_db_pool_checkouts_total',
+    'Connections taken from the pool.',
+    ['alias'],
+)
+pool_timeouts_total = Counter(
+    'django_db_pool_timeouts_total',
+    'Checkouts that timed out waiting for a free connection.',
+    ['alias'],
+)
+pool_discarded_total = Counter(
+    'django_db_pool_discarded_total',
+    'Pooled connections closed as broken, expired or idle too long.',
+    ['alias'],
+)
+pool_connections_in_use = Gauge(
+    'django_db_pool_connections_in_use',
+    'Connections currently checked out of the pool.',
+    ['alias'],
+)
+pool_connections_open = Gauge(
+    'django_db_pool_connections_open',
+    'Connections currently opened by the pool.',
+    ['alias'],
+)
+pool_max_size = Gauge(
+    'django_db_pool_max_size',
+    'Maximum number of connections in the pool.',
+    ['alias'],
+)
+
+
+class ConnectionPool:
+    '''
+    Ограниченный пул соединений с PostgreSQL одного процесса.
+    Если все max_size соединений заняты, запрос ждет свободное
+    не дольше timeout секунд. Перед выдачей соединение, простоявшее
+    дольше check_idle секунд, проверяется запросом SELECT 1,
+    а соединения старше max_lifetime секунд закрываются.
+    '''
+
+    def __init__(self, alias, max_size, timeout, max_lifetime, check_idle):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._idle = deque()
+        self._open = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        pool_max_size.labels(alias).set(max_size)
+
+    def checkout(self, connect):
+        '''
+        Возвращает соединение и время его создания.
+        connect открывает новое соединение, если свободных нет
+        и пул еще не заполнен.
+        '''
+        started = time.monotonic()
+        while True:
+            entry = self._take(started + self.timeout)
+            if entry is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self._forget()
+                    raise
+                created = time.monotonic()
+            else:
+                connection, created, released = entry
+                if not self._is_usable(connection, created, released):
+                    self._close(connection)
+                    continue
+            break
+        with self._condition:
+            self._in_use += 1
+            pool_connections_in_use.labels(self.alias).set(self._in_use)
+        pool_wait_seconds.labels(self.alias).observe(
+            time.monotonic() - started)
+        pool_checkouts_total.labels(self.alias).inc()
+        return connection, created
+
+    def release(self, connection, created):
+        '''
+        Возвращает соединение в пул. Незавершенная транзакция
+        откатывается, сломанное соединение закрывается.
+        '''
+        with self._condition:
+            self._in_use -= 1
+            pool_connections_in_use.labels(self.alias).set(self._in_use)
+        try:
+            status = connection.info.transaction_status
+            if connection.closed or status == TRANSACTION_STATUS_UNKNOWN:
+                raise DatabaseError('connection is broken')
+            if status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except DatabaseError:
+            self._close(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, created, time.monotonic()))
+            self._condition.notify()
+
+    def discard(self, connection):
+        '''Закрывает выданное соединение, не возвращая его в пул.'''
+        with self._condition:
+            self._in_use -= 1
+            pool_connections_in_use.labels(self.alias).set(self._in_use)
+        self._close(connection)
+
+    def _take(self, deadline):
+        '''
+        Берет свободное соединение или резервирует место для нового
+        (возвращает None). Последнее возвращенное соединение выдается
+        первым, чтобы лишние соединения простаивали и закрывались.
+        '''
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.max_size:
+                    self._open += 1
+                    pool_connections_open.labels(self.alias).set(self._open)
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    pool_timeouts_total.labels(self.alias).inc()
+                    raise OperationalError(
+                        f'Нет свободного соединения с базой данных '
+                        f'{self.alias} за {self.timeout} с, '
+                        f'заняты все {self.max_size}.')
+                self._condition.wait(remaining)
+
+    def _is_usable(self, connection, created, released):
+        now = time.monotonic()
+        if connection.closed or now - created > self.max_lifetime:
+            return False
+        if now - released < self.check_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except DatabaseError:
+            return False
+        return True
+
+    def _close(self, connection):
+        pool_discarded_total.labels(self.alias).inc()
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._open -= 1
+            pool_connections_open.labels(self.alias).set(self._open)
+            self._condition.notify()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict) -> ConnectionPool:
+    '''Пул соединений процесса для базы данных alias.'''
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                options = settings_dict.get('POOL', {})
+                pool = _pools[alias] = ConnectionPool(
+                    alias,
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 10),
+                    max_lifetime=options.get('MAX_LIFETIME', 30 * 60),
+                    check_idle=options.get('CHECK_IDLE', 30),
+                )
+    return pool
+
+
+def _reset_pools():
+    # Соединения родительского процесса нельзя использовать после fork.
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_reset_pools)
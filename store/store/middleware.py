@@ -0,0 +1,152 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+view_db_queries = Histogram(
+    'django_view_db_queries',
+    'SQL queries per request by view and action.',
+    ['view', 'action'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233),
+)
+view_db_query_seconds = Histogram(
+    'django_view_db_query_seconds',
+    'Cumulative SQL time per request by view and action.',
+    ['view', 'action'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+             2.5, 5, 10),
+)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(sql) -> str:
+    '''Приводит похожие запросы к одному виду: без значений и списков IN.'''
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _LITERAL.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    '''Считает запросы и их суммарное время через execute_wrapper.'''
+
+    def __init__(self):
+        self.statements = []
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.statements.append(sql)
+
+
+_current_recorder = ContextVar('query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    '''
+    Передает запрос QueryRecorder текущего HTTP-запроса. Переменная
+    контекста видна и в потоках sync_to_async, в которых под ASGI
+    выполняются запросы к базе данных.
+    '''
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_query_recorder_on_connect(sender, connection, **kwargs):
+    # Соединения потоков sync_to_async создаются уже после
+    # загрузки middleware.
+    install_query_recorder(connection)
+
+
+class QueryMetricsMiddleware:
+    '''
+    Записывает в Prometheus число SQL-запросов и их суммарное время
+    для каждого представления и действия. Запросы сверх бюджета
+    QUERY_COUNT_BUDGET пишутся в лог, повторяющиеся запросы
+    группируются. Под ASGI запросы к базе данных выполняются
+    в потоках sync_to_async со своими соединениями, поэтому запросы
+    учитываются оберткой соединения record_query, а не оберткой
+    на время запроса.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        self.record(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        self.record(request, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Для ViewSet DRF действие берется из привязки методов к actions.
+        method = request.method.lower()
+        request.query_metrics_labels = (
+            request.resolver_match.view_name,
+            getattr(view_func, 'actions', {}).get(method, method),
+        )
+
+    def record(self, request, recorder):
+        view, action = getattr(request, 'query_metrics_labels',
+                               ('unresolved', request.method.lower()))
+        count = len(recorder.statements)
+        view_db_queries.labels(view, action).observe(count)
+        view_db_query_seconds.labels(view, action).observe(
+            recorder.duration)
+        if count > settings.QUERY_COUNT_BUDGET:
+            statements = Counter(normalize_sql(sql)
+                                 for sql in recorder.statements)
+            logger.warning(
+                '%s %s (%s %s): %d SQL-запросов при бюджете %d, %.1f мс\n%s',
+                request.method, request.path, view, action, count,
+                settings.QUERY_COUNT_BUDGET, recorder.duration * 1000,
+                '\n'.join(f'{number} x {sql}'
+                          for sql, number in statements.most_common()))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Пагинатор списков админки для больших таблиц. Для списка
+    без фильтров число строк берется из статистики PostgreSQL
+    (pg_class.reltuples) вместо COUNT(*) по всей таблице, если оценка
+    больше ADMIN_ESTIMATED_COUNT_THRESHOLD. Для небольших таблиц,
+    списков с фильтрами и других баз данных число строк точное.
+    '''
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate_count()
+        if (estimate is not None
+                and estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD):
+            return estimate
+        return super().count
+
+    def estimate_count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where or query.distinct:
+            return None
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                [self.object_list.model._meta.db_table])
+            row = cursor.fetchone()
+        # До первого ANALYZE таблицы reltuples равно -1.
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
@@ -35,6 +35,7 @@ SILENCED_SYSTEM_CHECKS = ['security.W019']
 
 MIDDLEWARE = [
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
+    'store.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,18 +70,68 @@ PROMETHEUS_EXPORT_MIGRATIONS = os.getenv('PROMETHEUS_EXPORT_MIGRATIONS', 'False'
 
 # PROMETHEUS_METRICS_EXPORT_PORT_RANGE = range(8001, 8050)
 
+# DB_POOL=True: соединения берутся из ограниченного пула процесса
+# и возвращаются в него в конце запроса. Без пула соединения можно
+# держать открытыми между запросами через DB_CONN_MAX_AGE.
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django_prometheus.db.backends.postgresql',
+        'ENGINE': ('store.db_pool' if DB_POOL
+                   else 'django_prometheus.db.backends.postgresql'),
         'NAME': os.getenv('POSTGRES_DB', 'grocery'),
         'USER': os.getenv('POSTGRES_USER', 'grocery'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'grocery'),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(
+            os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+        'POOL': {
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'MAX_LIFETIME': int(os.getenv('DB_POOL_MAX_LIFETIME', 30 * 60)),
+            'CHECK_IDLE': int(os.getenv('DB_POOL_CHECK_IDLE', 30)),
+        },
     }
 }
 
 
+# Кэш представлений каталога. Без CACHE_REDIS_URL используется
+# локальная память процесса с вытеснением давно не читанных записей.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', 10000))
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'catalog',
+            'TIMEOUT': CATALOG_CACHE_TIMEOUT,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'default',
+        },
+        'catalog': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'catalog',
+            'TIMEOUT': CATALOG_CACHE_TIMEOUT,
+            'OPTIONS': {'MAX_ENTRIES': CATALOG_CACHE_MAX_ENTRIES},
+        },
+    }
+
+
 DATABASES_SQLITE = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -88,6 +139,10 @@ DATABASES_SQLITE = {
     }
 }
 
+# DB_SQLITE=True: локальный запуск без PostgreSQL, например бенчмарка.
+if os.getenv('DB_SQLITE', 'False') == 'True':
+    DATABASES = DATABASES_SQLITE
+
 # LOGGING = {
 #     'version': 1,
 #     'disable_existing_loggers': False,
@@ -136,13 +191,29 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
+    'EXCEPTION_HANDLER': 'api.exceptions.api_exception_handler',
     'SEARCH_PARAM': 'name',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 3,
 }
 
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', 100))
+
+# Запросы с большим числом SQL-запросов пишутся в лог.
+QUERY_COUNT_BUDGET = int(os.getenv('QUERY_COUNT_BUDGET', 20))
+
+# Списки админки без фильтров по таблицам больше этого числа строк
+# показывают оценку числа строк из статистики PostgreSQL.
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(
+    os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000))
+
+# Время жизни снимка пользователя токена в кэше аутентификации,
+# 0 - без кэша. С кэшем в памяти процесса (без CACHE_REDIS_URL)
+# выход пользователя в других процессах действует через это время.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
 
 DJOSER = {
     'SERIALIZERS': {
@@ -167,11 +238,37 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 
-STATIC_ROOT = os.path.join(BASE_DIR, "static")
+STATIC_ROOT = os.getenv("STATIC_ROOT", os.path.join(BASE_DIR, "static"))
 
 MEDIA_URL = "/media/"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Загрузка изображений в base64. Декодированный файл больше
+# FILE_UPLOAD_MAX_MEMORY_SIZE записывается во временный файл на диске.
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE',
+                                      5 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS',
+                                        25_000_000))
+# Товар создается с тремя изображениями, base64 длиннее данных на треть.
+# Размер тела запросов к API ограничен тем же DATA_UPLOAD_MAX_MEMORY_SIZE.
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv(
+    'DATA_UPLOAD_MAX_MEMORY_SIZE', 3 * IMAGE_UPLOAD_MAX_SIZE * 4 // 3
+    + 1024 * 1024))
+
+# Отпечатки шагов команды bootstrap. Файл должен храниться
+# в томе, который сохраняется между перезапусками контейнера.
+BOOTSTRAP_STATE_FILE = os.getenv(
+    'BOOTSTRAP_STATE_FILE', os.path.join(BASE_DIR, '.bootstrap.json'))
+
+# Миниатюры изображений создаются в фоновых потоках.
+IMAGE_RENDITION_SIZE = int(os.getenv('IMAGE_RENDITION_SIZE', 600))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
+# Товары в корзине, количество которых не менялось дольше
+# CART_RESERVATION_TTL секунд, возвращаются на склад командой
+# release_expired_reservations.
+CART_RESERVATION_TTL = int(os.getenv('CART_RESERVATION_TTL', 24 * 60 * 60))
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
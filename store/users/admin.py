@@ -1,13 +1,31 @@
 from django.contrib import admin
+from django.db import transaction
 
 from .models import User
+from products.models import CartProduct
+from products.receivers import cart_stock_released
+from products.services import release_cart_products
 from store.constans import EMPTY_VALUE
+from store.paginator import EstimatedCountPaginator
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username',
                     'email', 'date_joined')
-    list_filter = ('username', 'email',)
+    list_filter = ('is_staff', 'is_active')
     search_fields = ('email', 'username')
     empty_value_display = EMPTY_VALUE
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        '''
+        Возвращает на склад товары корзин всех удаляемых пользователей
+        разом, а не отдельно при каскадном удалении каждой корзины.
+        '''
+        release_cart_products(
+            CartProduct.objects.filter(cart__user__in=queryset))
+        with cart_stock_released():
+            super().delete_queryset(request, queryset)